@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_filters',
     'rest_framework.authtoken',
@@ -130,3 +131,32 @@ STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+RECIPES_KEYSET_PAGINATION = os.getenv(
+    'RECIPES_KEYSET_PAGINATION', default='False') == 'True'
+
+RECIPES_EXACT_COUNT_LIMIT = int(
+    os.getenv('RECIPES_EXACT_COUNT_LIMIT', default=1000))
+
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=5 * 1024 * 1024))
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=20))
+
+INGREDIENT_CATALOG_TIMEOUT = int(
+    os.getenv('INGREDIENT_CATALOG_TIMEOUT', default=60 * 5))
+
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', default=2))
+
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', default=1))
+
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', default=3))
+
+JOBS_STALE_TIMEOUT = int(os.getenv('JOBS_STALE_TIMEOUT', default=60 * 10))
+
+TAGS_CACHE_MAX_AGE = int(os.getenv('TAGS_CACHE_MAX_AGE', default=60 * 10))
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
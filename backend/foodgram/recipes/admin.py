@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import (Favorite, Ingredient, IngredientInRecipe,
+from .models import (Favorite, Ingredient, IngredientInRecipe, Job,
                      ShoppingCart, Recipe, TagInRecipe, Tag)
 
 
@@ -10,7 +10,7 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author', 'tags')
 
     def in_favorite(self, obj):
-        return len(obj.in_favorites.all())
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
@@ -34,5 +34,11 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'argument', 'status', 'attempts', 'created')
+    list_filter = ('status', 'task')
+
+
 admin.site.register(Tag)
 admin.site.register(IngredientInRecipe)
@@ -0,0 +1,141 @@
+"""Каталог ингредиентов в памяти процесса.
+
+Справочник ингредиентов меняется редко (загрузка через db_script или
+админку), а читается при каждом поиске и создании рецепта. Каталог
+хранит его компактно: идентификаторы в array, названия интернированы,
+единицы измерения хранятся номерами в общем кортеже.
+
+Актуальность каталога проверяется по версии в кеше Django: изменение
+ингредиентов удаляет ключ версии, и при следующем обращении каталог
+перестраивается. Если кеш не общий для процессов (LocMemCache), другие
+процессы узнают об изменениях не позже чем через
+INGREDIENT_CATALOG_TIMEOUT секунд.
+"""
+import bisect
+import sys
+import threading
+import time
+import uuid
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Ingredient
+
+INGREDIENT_CATALOG_VERSION_KEY = 'ingredient_catalog_version'
+
+
+def get_ingredient_catalog_version():
+    return cache.get_or_set(
+        INGREDIENT_CATALOG_VERSION_KEY,
+        lambda: uuid.uuid4().hex,
+        timeout=None
+    )
+
+
+def invalidate_ingredient_catalog():
+    cache.delete(INGREDIENT_CATALOG_VERSION_KEY)
+
+
+class IngredientCatalog:
+    """Неизменяемый снимок справочника ингредиентов."""
+
+    def __init__(self, rows, db=None):
+        self.db = db
+        units = {}
+        entries = []
+        for pk, name, unit in sorted(rows):
+            unit = units.setdefault(unit, len(units))
+            entries.append((pk, sys.intern(name), unit))
+
+        self.units = tuple(sys.intern(unit) for unit in units)
+        self.ids = array('l', (pk for pk, _, _ in entries))
+        self.names = [name for _, name, _ in entries]
+        self.unit_numbers = array(
+            'H' if len(self.units) <= 0xFFFF else 'L',
+            (unit for _, _, unit in entries)
+        )
+
+        # Порядок для поиска по префиксу без учета регистра.
+        order = sorted(range(len(entries)),
+                       key=lambda i: (self.names[i].lower(), self.ids[i]))
+        self.search_keys = [self.names[i].lower() for i in order]
+        self.search_order = array('l', order)
+
+    @classmethod
+    def load(cls):
+        queryset = Ingredient.objects.all()
+        return cls(
+            queryset.values_list('pk', 'name', 'measurement_unit'),
+            db=queryset.db
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _position(self, pk):
+        position = bisect.bisect_left(self.ids, pk)
+        if position < len(self.ids) and self.ids[position] == pk:
+            return position
+        return None
+
+    def _ingredient(self, position):
+        return Ingredient.from_db(
+            self.db,
+            ('id', 'name', 'measurement_unit'),
+            (self.ids[position], self.names[position],
+             self.units[self.unit_numbers[position]])
+        )
+
+    def get(self, pk):
+        try:
+            position = self._position(int(pk))
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if position is None:
+            return None
+        return self._ingredient(position)
+
+    def in_bulk(self, ids):
+        result = {}
+        for pk in ids:
+            ingredient = self.get(pk)
+            if ingredient is not None:
+                result[pk] = ingredient
+        return result
+
+    def all(self):
+        return [self._ingredient(i) for i in range(len(self.ids))]
+
+    def search(self, query, limit=None):
+        """Ингредиенты, название которых начинается с query
+        (без учета регистра), в алфавитном порядке."""
+        query = query.lower()
+        start = bisect.bisect_left(self.search_keys, query)
+        result = []
+        for key, position in zip(self.search_keys[start:],
+                                 self.search_order[start:]):
+            if not key.startswith(query) or len(result) == limit:
+                break
+            result.append(self._ingredient(position))
+        return result
+
+
+_lock = threading.Lock()
+_state = {'catalog': None, 'version': None, 'loaded_at': 0}
+
+
+def get_ingredient_catalog():
+    """Возвращает актуальный каталог, при необходимости
+    перестраивая его."""
+    version = get_ingredient_catalog_version()
+    with _lock:
+        if (_state['version'] == version
+                and time.monotonic() - _state['loaded_at']
+                < settings.INGREDIENT_CATALOG_TIMEOUT):
+            return _state['catalog']
+        catalog = IngredientCatalog.load()
+        _state.update(catalog=catalog, version=version,
+                      loaded_at=time.monotonic())
+    return catalog
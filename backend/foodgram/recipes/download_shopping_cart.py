@@ -1,41 +1,109 @@
-import datetime
-from django.http import FileResponse
-import os
+import threading
+import uuid
 
-from foodgram import settings
-from .models import Ingredient, IngredientInRecipe, ShoppingCart
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 
+from .models import IngredientInRecipe, ShoppingCart
+
+SHOPPING_CART_VERSION_KEY = 'shopping_cart_version:{user_id}'
+SHOPPING_CART_KEY = 'shopping_cart:{user_id}:{version}:{format}'
+SHOPPING_CART_TIMEOUT = 60 * 60 * 24
 
-def download_shopping_cart(request):
-    file_path = os.path.join(
-        settings.MEDIA_ROOT,
-        'recipes/shopping_cart/',
-        str(request.user)
-    )
 
-    os.makedirs(file_path, exist_ok=True)
-    file = os.path.join(
-        file_path, str(datetime.datetime.now()) + '.txt'
+def get_shopping_cart_version(user_id):
+    """Возвращает текущую версию списка покупок пользователя.
+    Версия меняется при любом изменении списка."""
+    return cache.get_or_set(
+        SHOPPING_CART_VERSION_KEY.format(user_id=user_id),
+        lambda: uuid.uuid4().hex,
+        timeout=None
     )
 
+
+def invalidate_shopping_cart(*user_ids):
+    cache.delete_many([
+        SHOPPING_CART_VERSION_KEY.format(user_id=user_id)
+        for user_id in user_ids
+    ])
+
+
+# Изменения, ожидающие фиксации транзакции в текущем потоке.
+pending = threading.local()
+
+
+def invalidate_shopping_carts_on_commit(user_ids=(), recipe_ids=()):
+    """Сбрасывает списки покупок пользователей user_ids и всех, у кого
+    в корзине рецепты recipe_ids, после фиксации транзакции.
+
+    Если сбросить версию раньше, выгрузка между сбросом и фиксацией
+    прочитает старые строки и закеширует их под новой версией.
+    Изменения копятся до фиксации, так что рецепты ищутся в корзинах
+    одним запросом. После отката накопленное сбросится со следующей
+    транзакцией — лишний сброс кеша безопасен.
+    """
+    if not hasattr(pending, 'user_ids'):
+        pending.user_ids, pending.recipe_ids = set(), set()
+    pending.user_ids.update(user_ids)
+    pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(flush_shopping_cart_invalidations)
+
+
+def flush_shopping_cart_invalidations():
+    user_ids = getattr(pending, 'user_ids', set())
+    recipe_ids = getattr(pending, 'recipe_ids', set())
+    pending.user_ids, pending.recipe_ids = set(), set()
+    if recipe_ids:
+        user_ids |= set(ShoppingCart.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('user_id', flat=True))
+    if user_ids:
+        invalidate_shopping_cart(*user_ids)
+
+
+def get_shopping_cart_ingredients(user):
+    """Суммирует ингредиенты всех рецептов из списка покупок
+    пользователя одним запросом."""
+    return IngredientInRecipe.objects.filter(
+        recipe__in_shopping_cart__user=user
+    ).values(
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit')
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by('name', 'measurement_unit')
+
+
+def download_shopping_cart(request):
+    """Отдает список покупок в формате, выбранном при согласовании
+    содержимого (см. recipes.renderers)."""
     user = request.user
-    purchases = ShoppingCart.objects.filter(user=user)
-
-    with open(file, 'w') as f:
-        cart = dict()
-        for purchase in purchases:
-            ingredients = IngredientInRecipe.objects.filter(
-                recipe=purchase.recipe.id
-            )
-            for r in ingredients:
-                i = Ingredient.objects.get(pk=r.ingredient.id)
-                point_name = f'{i.name} ({i.measurement_unit})'
-                if point_name in cart.keys():
-                    cart[point_name] += r.amount
-                else:
-                    cart[point_name] = r.amount
-
-        for name, amount in cart.items():
-            f.write(f'* {name} - {amount}\n')
-
-    return FileResponse(open(file, 'rb'), as_attachment=True)
+    renderer = request.accepted_renderer
+    version = get_shopping_cart_version(user.id)
+    etag = quote_etag(f'{version}-{renderer.format}')
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        key = SHOPPING_CART_KEY.format(
+            user_id=user.id, version=version, format=renderer.format)
+        content = cache.get(key)
+        if content is None:
+            content = b''.join(renderer.render_rows(
+                get_shopping_cart_ingredients(user).iterator()))
+            cache.set(key, content, SHOPPING_CART_TIMEOUT)
+
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.format}"'
+        )
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Accept'
+    return response
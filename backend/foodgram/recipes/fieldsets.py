@@ -0,0 +1,96 @@
+"""Выборочный вывод полей: параметры ?fields= и ?expand=.
+
+Без параметров ответ не меняется: все поля, связи раскрыты.
+Если передан хотя бы один из параметров:
+- fields — список полей через запятую (по умолчанию все);
+- expand — связи, которые выводятся вложенными объектами; остальные
+  запрошенные связи выводятся только идентификаторами. Раскрытая связь
+  попадает в ответ, даже если не указана в fields.
+
+Viewset по набору полей решает, что подгружать из базы, так что
+незапрошенные связи не попадают ни в запросы, ни в ответ.
+"""
+from rest_framework import serializers
+
+
+class Fieldset:
+    def __init__(self, fields, expand):
+        self.fields = frozenset(fields) | frozenset(expand)
+        self.expand = frozenset(expand)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def expands(self, name):
+        return name in self.expand
+
+
+def split_param(request, param):
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def get_fieldset(request, serializer_class):
+    """Разбирает параметры запроса для serializer_class. Возвращает
+    None, если выборочный вывод не запрошен."""
+    fields = split_param(request, 'fields')
+    expand = split_param(request, 'expand')
+    if fields is None and expand is None:
+        return None
+
+    available = serializer_class.Meta.fields
+    expandable = serializer_class.expandable_fields
+    errors = {}
+    unknown = sorted(set(fields or ()) - set(available))
+    if unknown:
+        errors['fields'] = f'Неизвестные поля: {", ".join(unknown)}.'
+    unknown = sorted(set(expand or ()) - set(expandable))
+    if unknown:
+        errors['expand'] = (f'Нельзя раскрыть: {", ".join(unknown)}. '
+                            f'Доступны: {", ".join(expandable)}.')
+    if errors:
+        raise serializers.ValidationError(errors)
+    return Fieldset(available if fields is None else fields, expand or ())
+
+
+class SparseFieldsetSerializerMixin:
+    """Сериализатор, который принимает fieldset и оставляет только
+    запрошенные поля. Нераскрытые связи из expandable_fields заменяются
+    полями из get_collapsed_field."""
+    expandable_fields = ()
+
+    def __init__(self, *args, fieldset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fieldset is None:
+            return
+        for name in list(self.fields):
+            if name not in fieldset:
+                self.fields.pop(name)
+            elif (name in self.expandable_fields
+                  and not fieldset.expands(name)):
+                self.fields[name] = self.get_collapsed_field(name)
+
+    def get_collapsed_field(self, name):
+        raise NotImplementedError
+
+
+class SparseFieldsetViewMixin:
+    """Передает сериализатору fieldset из параметров запроса
+    для действий из sparse_actions."""
+    sparse_actions = ('list', 'retrieve')
+
+    def get_fieldset(self, serializer_class=None):
+        if self.action not in self.sparse_actions:
+            return None
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = get_fieldset(
+                self.request, serializer_class or self.get_serializer_class())
+        return self._fieldset
+
+    def get_serializer(self, *args, **kwargs):
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            kwargs.setdefault('fieldset', fieldset)
+        return super().get_serializer(*args, **kwargs)
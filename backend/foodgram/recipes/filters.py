@@ -1,12 +1,21 @@
 from django_filters import rest_framework as filters
 from django_filters.widgets import BooleanWidget
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend
 
-from .models import Recipe, Tag
+from .models import Favorite, Recipe, ShoppingCart, Tag, TagInRecipe
+from .search import search_ingredients
 
 
-class CustomSearchFilter(SearchFilter):
-    search_param = "name"
+class IngredientSearchFilter(BaseFilterBackend):
+    """Поиск ингредиентов по началу названия с ограничением
+    числа результатов (см. recipes.search)."""
+    search_param = 'name'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query or getattr(view, 'action', None) != 'list':
+            return queryset
+        return search_ingredients(query)
 
 
 class RecipeFilter(filters.FilterSet):
@@ -14,7 +23,8 @@ class RecipeFilter(filters.FilterSet):
         field_name='tags__slug',
         queryset=Tag.objects.all(),
         label='Tags',
-        to_field_name='slug'
+        to_field_name='slug',
+        method='get_tags'
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited',
@@ -30,14 +40,28 @@ class RecipeFilter(filters.FilterSet):
         fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart']
         ordering = ['-id']
 
-    def get_is_favorited(self, queryset, name, value):
+    # Фильтры по тэгам и отметкам пользователя — полусоединения
+    # через id__in: рецепт попадает
+    # в выдачу один раз, сколько бы тэгов или отметок ни совпало.
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(pk__in=TagInRecipe.objects.filter(
+            tag__in=value).values('recipe_id'))
+
+    def filter_by_user(self, queryset, model):
         user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(pk__in=model.objects.filter(
+            user=user).values('recipe_id'))
+
+    def get_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(in_favorites__user=user)
+            return self.filter_by_user(queryset, Favorite)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
         if value:
-            return queryset.filter(in_shopping_cart__user=user)
+            return self.filter_by_user(queryset, ShoppingCart)
         return queryset
@@ -0,0 +1,325 @@
+"""Картинки рецептов: разбор присланных строкой base64 (data URI),
+хранение по хешу содержимого и уменьшенные копии для карточек
+и ленты. Копии создаются фоновой задачей, чтобы не задерживать ответ
+на сохранение рецепта.
+
+Одинаковые картинки хранятся одним файлом recipes/<sha256>.<формат>,
+на который ссылаются все такие рецепты. Файл и его копии удаляются,
+когда на картинку не остается ссылок.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .jobs import enqueue, task
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Длина кратна 4, чтобы каждый кусок декодировался независимо.
+DECODE_CHUNK_SIZE = 64 * 1024
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+class ImageDecodeError(ValueError):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def sniff_image_format(head):
+    """Определяет формат по первым байтам файла, а не по
+    заявленному в data URI типу."""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def decoded_size(data, start):
+    """Размер данных после декодирования, вычисленный по длине
+    строки base64 без самого декодирования."""
+    length = len(data) - start
+    if length % 4:
+        raise ImageDecodeError('invalid_base64')
+    padding = data[-2:].count('=') if length else 0
+    return length // 4 * 3 - padding
+
+
+def create_upload(size):
+    """Небольшие файлы собираются в памяти, большие (больше
+    FILE_UPLOAD_MAX_MEMORY_SIZE) пишутся во временный файл, как это
+    делают обработчики загрузки Django."""
+    if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        return TemporaryUploadedFile(
+            'upload', 'application/octet-stream', size, None)
+    return InMemoryUploadedFile(
+        io.BytesIO(), None, 'upload', 'application/octet-stream',
+        size, None)
+
+
+def decode_into(upload, data, start):
+    """Декодирует base64 из data[start:] в upload по кускам и
+    возвращает формат изображения."""
+    image_format = None
+    for offset in range(start, len(data), DECODE_CHUNK_SIZE):
+        try:
+            chunk = base64.b64decode(
+                data[offset:offset + DECODE_CHUNK_SIZE], validate=True)
+        except binascii.Error:
+            raise ImageDecodeError('invalid_base64')
+        if image_format is None:
+            image_format = sniff_image_format(chunk)
+            if image_format is None:
+                raise ImageDecodeError('unknown_format')
+        upload.write(chunk)
+    if image_format is None:
+        raise ImageDecodeError('invalid_base64')
+    return image_format
+
+
+def decode_data_uri(data):
+    """Декодирует data URI с изображением в загруженный файл.
+
+    Размер проверяется до декодирования, формат определяется по
+    первым байтам, а не по типу из data URI.
+    """
+    start = data.find(';base64,')
+    if start == -1:
+        raise ImageDecodeError('invalid_base64')
+    start += len(';base64,')
+
+    size = decoded_size(data, start)
+    if size > settings.RECIPE_IMAGE_MAX_SIZE:
+        raise ImageDecodeError('too_large')
+    upload = create_upload(size)
+    try:
+        image_format = decode_into(upload, data, start)
+    except ImageDecodeError:
+        upload.close()
+        raise
+
+    upload.seek(0)
+    upload.name = f'image.{image_format}'
+    upload.content_type = f'image/{image_format}'
+    return upload
+
+
+IMAGES_DIR = 'recipes'
+
+
+def content_name(upload):
+    """Имя файла по SHA-256 содержимого и формату изображения.
+    Имя, присланное клиентом, не используется: разные картинки
+    с одинаковым именем не должны совпасть."""
+    digest = hashlib.sha256()
+    head = None
+    for chunk in upload.chunks():
+        if head is None:
+            head = chunk[:16]
+        digest.update(chunk)
+    upload.seek(0)
+    image_format = sniff_image_format(head or b'')
+    if image_format is None:
+        image_format = Image.open(upload).format.lower()
+        upload.seek(0)
+    return f'{digest.hexdigest()}.{image_format}'
+
+
+def store_image(upload, storage=default_storage):
+    """Сохраняет загруженную картинку под именем по хешу содержимого
+    и возвращает имя файла.
+
+    Если такая картинка уже есть, файл не записывается заново. Но
+    параллельная транзакция, удалившая последний рецепт с этой
+    картинкой, не видит нового рецепта и может удалить файл, поэтому
+    после фиксации файл проверяется и при необходимости записывается
+    снова.
+    """
+    name = f'{IMAGES_DIR}/{content_name(upload)}'
+    if not storage.exists(name):
+        return storage.save(name, upload)
+    content = ContentFile(upload.read())
+    transaction.on_commit(lambda: restore_image(name, content, storage))
+    return name
+
+
+def restore_image(name, content, storage=default_storage):
+    """Записывает картинку, удаленную вместе с копиями, пока на нее
+    ссылался еще не зафиксированный рецепт, и заново ставит в очередь
+    создание копий."""
+    if storage.exists(name):
+        return
+    storage.save(name, content)
+    recipes = Recipe.objects.filter(image=name)
+    recipes.update(derivatives_source='')
+    for recipe_id in recipes.values_list('pk', flat=True):
+        enqueue('recipes.generate_derivatives', recipe_id)
+
+
+def release_image(name, storage=default_storage):
+    """Удаляет файл картинки вместе с копиями, если на него больше
+    не ссылается ни один рецепт. Возвращает True, если файл удален."""
+    if not name or Recipe.objects.filter(image=name).exists():
+        return False
+    storage.delete(name)
+    for target in derivative_names(name):
+        storage.delete(target)
+    return True
+
+
+def release_image_on_commit(name):
+    """Удаление файла откладывается до фиксации транзакции: при
+    откате рецепт снова ссылается на картинку."""
+    if name:
+        transaction.on_commit(lambda: release_image(name))
+
+
+# Уменьшенные копии: наибольшая сторона в пикселях. Каждая
+# сохраняется в JPEG и WebP.
+RENDITIONS = {
+    'thumbnail': 200,
+    'feed': 600,
+}
+DERIVATIVE_FORMATS = {
+    'jpeg': {'quality': 85, 'optimize': True, 'progressive': True},
+    'webp': {'quality': 80, 'method': 6},
+}
+DERIVATIVES_DIR = 'recipes/derivatives'
+
+
+def derivative_name(name, rendition, image_format):
+    """Имя копии включает имя оригинала целиком, с расширением:
+    у старых картинок temp.png и temp.jpeg копии должны различаться."""
+    extension = 'jpg' if image_format == 'jpeg' else image_format
+    return (f'{DERIVATIVES_DIR}/{os.path.basename(name)}'
+            f'-{rendition}.{extension}')
+
+
+def derivative_names(name):
+    return [derivative_name(name, rendition, image_format)
+            for rendition in RENDITIONS
+            for image_format in DERIVATIVE_FORMATS]
+
+
+def derivatives_exist(name, storage=default_storage):
+    """Копии одинаковых картинок общие, так что для повторно
+    загруженной картинки они могут быть уже готовы."""
+    return all(storage.exists(target) for target in derivative_names(name))
+
+
+def render_derivative(image, size, image_format):
+    copy = image.copy()
+    copy.thumbnail((size, size), Image.LANCZOS)
+    if image_format == 'jpeg' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    elif copy.mode not in ('RGB', 'RGBA'):
+        copy = copy.convert('RGBA')
+    buffer = io.BytesIO()
+    copy.save(buffer, image_format, **DERIVATIVE_FORMATS[image_format])
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, storage=default_storage):
+    """Создает все уменьшенные копии картинки name в хранилище.
+    Имена копий выводятся из имени оригинала, поэтому существующие
+    копии перезаписываются."""
+    with storage.open(name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    for rendition, size in RENDITIONS.items():
+        for image_format in DERIVATIVE_FORMATS:
+            target = derivative_name(name, rendition, image_format)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(
+                render_derivative(image, size, image_format)))
+
+
+def mark_derivatives_ready(recipe, name):
+    Recipe.objects.filter(pk=recipe.pk).update(derivatives_source=name)
+    recipe.derivatives_source = name
+
+
+def update_recipe_derivatives(recipe, force=False):
+    """Создает копии картинки рецепта, если они еще не созданы для
+    текущей картинки. Возвращает True, если копии готовы."""
+    name = recipe.image.name
+    storage = recipe.image.storage
+    if not name or (recipe.derivatives_source == name and not force):
+        return False
+    if not storage.exists(name):
+        return False
+    if force or not derivatives_exist(name, storage):
+        try:
+            generate_derivatives(name, storage)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.warning('Не удалось создать копии картинки %s', name,
+                           exc_info=True)
+            return False
+    mark_derivatives_ready(recipe, name)
+    return True
+
+
+@task('recipes.generate_derivatives')
+def generate_recipe_derivatives(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is not None:
+        update_recipe_derivatives(recipe)
+
+
+def schedule_recipe_derivatives(recipe):
+    """Ставит в очередь создание копий для новой картинки рецепта.
+    Если копии этой картинки уже есть, рецепт сразу получает их."""
+    name = recipe.image.name
+    if not name or recipe.derivatives_source == name:
+        return
+    if derivatives_exist(name, recipe.image.storage):
+        mark_derivatives_ready(recipe, name)
+    else:
+        enqueue('recipes.generate_derivatives', recipe.pk)
+
+
+def derivatives_ready(recipe):
+    return bool(recipe.image.name) and (
+        recipe.derivatives_source == recipe.image.name)
+
+
+def get_image_urls(recipe, request=None):
+    """Ссылки на уменьшенные копии картинки рецепта. Пока копии
+    не созданы, все ссылки ведут на оригинал."""
+    name = recipe.image.name
+    if not name:
+        return None
+    storage = recipe.image.storage
+    ready = derivatives_ready(recipe)
+    urls = {}
+    for rendition in RENDITIONS:
+        for image_format in DERIVATIVE_FORMATS:
+            key = (rendition if image_format == 'jpeg'
+                   else f'{rendition}_{image_format}')
+            url = storage.url(
+                derivative_name(name, rendition, image_format)
+                if ready else name)
+            urls[key] = (request.build_absolute_uri(url)
+                         if request is not None else url)
+    return urls
@@ -0,0 +1,107 @@
+"""Чтение и запись справочника ингредиентов в CSV и JSON.
+
+Все функции работают с потоком и не держат файл в памяти целиком:
+CSV и JSON Lines читаются построчно, JSON-массив разбирается
+по одному объекту.
+"""
+import csv
+import json
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+class IngredientFileError(ValueError):
+    pass
+
+
+def read_csv(file):
+    for line, row in enumerate(csv.reader(file), start=1):
+        if len(row) != 2:
+            raise IngredientFileError(
+                f'Строка {line}: ожидалось название и единица измерения')
+        yield row
+
+
+def _json_row(item):
+    try:
+        return item['name'], item['measurement_unit']
+    except (KeyError, TypeError):
+        raise IngredientFileError(
+            f'Ожидался объект с name и measurement_unit, получено {item!r}')
+
+
+def read_json(file):
+    """Разбирает JSON-массив объектов, не загружая его целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        # Пропускаем пробелы, открывающую скобку и запятые
+        # между объектами.
+        while position < len(buffer) and (
+                buffer[position].isspace()
+                or buffer[position] == ','
+                or (buffer[position] == '[' and not started)):
+            started = started or buffer[position] == '['
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                if buffer[position:].strip():
+                    raise IngredientFileError('Некорректный JSON')
+                return
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if not started:
+            raise IngredientFileError('Ожидался JSON-массив')
+        yield _json_row(item)
+        position = end
+
+
+def read_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield _json_row(json.loads(line))
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.jsonl': read_json_lines,
+}
+
+
+def write_csv(file, rows):
+    writer = csv.writer(file, lineterminator='\n')
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_json(file, rows):
+    file.write('[')
+    for i, (name, measurement_unit) in enumerate(rows):
+        if i:
+            file.write(', ')
+        json.dump({'name': name, 'measurement_unit': measurement_unit},
+                  file, ensure_ascii=False)
+    file.write(']\n')
+
+
+def write_json_lines(file, rows):
+    for name, measurement_unit in rows:
+        json.dump({'name': name, 'measurement_unit': measurement_unit},
+                  file, ensure_ascii=False)
+        file.write('\n')
+
+
+WRITERS = {
+    '.csv': write_csv,
+    '.json': write_json,
+    '.jsonl': write_json_lines,
+}
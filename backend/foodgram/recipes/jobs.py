@@ -0,0 +1,75 @@
+"""Очередь фоновых задач в базе данных, без внешнего брокера.
+
+Задача ставится в очередь в той же транзакции, что и изменение
+данных, поэтому не теряется при откате и не начинает выполняться
+раньше, чем изменения станут видны. Воркеры (команда run_jobs)
+выбирают задачи через SELECT ... FOR UPDATE SKIP LOCKED, так что
+одну задачу не возьмут двое.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(name):
+    """Регистрирует функцию как задачу с именем name. Функция
+    получает единственный строковый аргумент."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, argument=''):
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача {name}')
+    return Job.objects.create(task=name, argument=str(argument))
+
+
+def requeue_stale_jobs():
+    """Возвращает в очередь задачи, которые слишком долго числятся
+    выполняющимися: их воркер, скорее всего, остановился."""
+    stale = timezone.now() - timedelta(seconds=settings.JOBS_STALE_TIMEOUT)
+    return Job.objects.filter(
+        status=Job.RUNNING, started__lt=stale
+    ).update(status=Job.PENDING)
+
+
+def claim_job():
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.PENDING).order_by('id').first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.started = timezone.now()
+        job.save(update_fields=('status', 'attempts', 'started'))
+    return job
+
+
+def run_job(job):
+    """Выполняет задачу. Успешная задача удаляется, неудачная
+    возвращается в очередь, пока не исчерпаны JOBS_MAX_ATTEMPTS
+    попыток."""
+    try:
+        TASKS[job.task](job.argument)
+    except Exception:
+        logger.exception('Задача %s завершилась ошибкой', job)
+        job.error = traceback.format_exc()
+        job.status = (Job.PENDING if job.attempts < settings.JOBS_MAX_ATTEMPTS
+                      else Job.FAILED)
+        job.save(update_fields=('status', 'error'))
+        return False
+    job.delete()
+    return True
@@ -0,0 +1,21 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Удаляет файлы списков покупок, которые раньше '
+            'сохранялись в MEDIA_ROOT при каждом скачивании.')
+
+    def handle(self, *args, **options):
+        path = os.path.join(settings.MEDIA_ROOT, 'recipes', 'shopping_cart')
+        if not os.path.isdir(path):
+            self.stdout.write('Сохраненных списков покупок нет')
+            return
+
+        count = sum(len(files) for _, _, files in os.walk(path))
+        shutil.rmtree(path)
+        self.stdout.write(
+            self.style.SUCCESS(f'Удалено списков покупок: {count}'))
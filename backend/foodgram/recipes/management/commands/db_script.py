@@ -1,26 +1,73 @@
-import csv
+import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
+from recipes.catalog import invalidate_ingredient_catalog
+from recipes.ingredient_io import READERS, IngredientFileError
 from recipes.models import Ingredient, Tag
 
+DEFAULT_PATH = os.path.join(
+    settings.BASE_DIR, 'recipes', 'data', 'ingredients.csv')
+
+
+def new_ingredients(rows):
+    """Отбрасывает пустые строки, повторы внутри файла и ингредиенты,
+    которые уже есть в базе."""
+    seen = set(Ingredient.objects.values_list('name', 'measurement_unit'))
+    for name, measurement_unit in rows:
+        key = (name.strip(), measurement_unit.strip())
+        if not all(key) or key in seen:
+            continue
+        seen.add(key)
+        yield Ingredient(name=key[0], measurement_unit=key[1])
+
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV, JSON или JSON Lines '
+            '(по умолчанию recipes/data/ingredients.csv) и базовые тэги.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def count_rows(self, rows):
+        for row in rows:
+            self.rows_read += 1
+            yield row
+
+    @transaction.atomic
+    def load(self, rows, batch_size):
+        created = 0
+        ingredients = new_ingredients(self.count_rows(rows))
+        while True:
+            batch = list(islice(ingredients, batch_size))
+            if not batch:
+                return created
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
 
     def handle(self, *args, **options):
-        with open(
-            f"{settings.BASE_DIR}/recipes/data/ingredients.csv",
-            "r",
-            encoding="utf-8",
-        ) as file:
-            file_reader = csv.reader(file)
-            for row in file_reader:
-                name, measurement_unit = row
-                Ingredient.objects.get_or_create(
-                    name=name,
-                    measurement_unit=measurement_unit)
-            file.close()
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError(
+                f'Неизвестный формат файла {path}, '
+                f'нужен один из {", ".join(READERS)}')
+
+        started = time.monotonic()
+        self.rows_read = 0
+        with open(path, 'r', encoding='utf-8') as file:
+            try:
+                created = self.load(reader(file), options['batch_size'])
+            except IngredientFileError as error:
+                raise CommandError(error)
+        # bulk_create не отправляет сигналы, каталог сбрасываем сами.
+        invalidate_ingredient_catalog()
+        elapsed = time.monotonic() - started
 
         tags = (
             ('Завтрак', '#0076FF', 'breakfast'),
@@ -35,4 +82,8 @@ class Command(BaseCommand):
                 color=color,
                 slug=slug
             )
-        self.stdout.write(self.style.SUCCESS('Ингредиенты и тэги добавлены'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты и тэги добавлены: прочитано строк '
+            f'{self.rows_read}, новых ингредиентов {created} за '
+            f'{elapsed:.2f} с ({self.rows_read / max(elapsed, 1e-6):.0f} '
+            f'строк/с)'))
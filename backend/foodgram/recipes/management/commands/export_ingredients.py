@@ -0,0 +1,52 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from recipes.ingredient_io import WRITERS
+from recipes.models import Ingredient
+
+CHUNK_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = ('Потоково выгружает справочник ингредиентов в CSV, JSON '
+            'или JSON Lines. Без пути CSV пишется в stdout.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument(
+            '--format', choices=[ext.lstrip('.') for ext in WRITERS],
+            help='Формат выгрузки (по умолчанию по расширению файла).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        extension = (f'.{options["format"]}' if options['format']
+                     else os.path.splitext(path)[1].lower() or '.csv')
+        if extension not in WRITERS:
+            raise CommandError(
+                f'Неизвестный формат файла {path}, '
+                f'нужен один из {", ".join(WRITERS)}')
+
+        if path == '-':
+            self.stdout.ending = ''
+            self.export(self.stdout, extension)
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            self.export(file, extension)
+        self.stderr.write(self.style.SUCCESS(f'Справочник выгружен в {path}'))
+
+    def export(self, file, extension):
+        if extension == '.csv' and connection.vendor == 'postgresql':
+            # COPY отдает строки прямо из базы, минуя ORM.
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    'COPY (SELECT name, measurement_unit '
+                    f'FROM {Ingredient._meta.db_table} ORDER BY id) '
+                    'TO STDOUT WITH (FORMAT csv)',
+                    file
+                )
+            return
+        rows = Ingredient.objects.order_by('pk').values_list(
+            'name', 'measurement_unit').iterator(chunk_size=CHUNK_SIZE)
+        WRITERS[extension](file, rows)
@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+from django.db.models import F
+
+from recipes.images import update_recipe_derivatives
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создает уменьшенные копии картинок рецептов (миниатюры '
+            'и WebP), которых еще нет.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать копии для всех рецептов.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'derivatives_source')
+        if not options['force']:
+            recipes = recipes.exclude(derivatives_source=F('image'))
+
+        created = skipped = 0
+        for recipe in recipes.iterator():
+            if update_recipe_derivatives(recipe, force=options['force']):
+                created += 1
+            else:
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Копии картинок созданы для {created} рецептов, '
+            f'пропущено {skipped}'))
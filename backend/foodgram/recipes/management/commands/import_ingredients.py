@@ -0,0 +1,181 @@
+import csv
+import io
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.catalog import invalidate_ingredient_catalog
+from recipes.ingredient_io import READERS, IngredientFileError
+from recipes.models import Ingredient
+
+STAGING_TABLE = 'recipes_ingredient_import'
+
+
+def clean_rows(rows, max_length):
+    """Обрезает пробелы и отбрасывает строки с пустыми или слишком
+    длинными значениями."""
+    for name, measurement_unit in rows:
+        name, measurement_unit = name.strip(), measurement_unit.strip()
+        if (name and measurement_unit and len(name) <= max_length
+                and len(measurement_unit) <= max_length):
+            yield name, measurement_unit
+
+
+class Checkpoint:
+    """Число строк файла, уже загруженных в базу.
+
+    Файл контрольной точки обновляется после фиксации каждой пачки,
+    поэтому при перезапуске с --resume загрузка продолжается с
+    первой незафиксированной строки. Размер и время изменения
+    исходного файла сверяются, чтобы не продолжить загрузку
+    другого файла.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        stat = os.stat(source)
+        self.source = {
+            'path': os.path.abspath(source),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding='utf-8') as file:
+            state = json.load(file)
+        if state['source'] != self.source:
+            raise CommandError(
+                f'Контрольная точка {self.path} относится к другому файлу')
+        return state['rows']
+
+    def save(self, rows):
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'source': self.source, 'rows': rows}, file)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkCreateLoader:
+    """Загрузка пачками через bulk_create для СУБД без COPY.
+    Дубли отсекает уникальное ограничение (name, measurement_unit)."""
+
+    def prepare(self):
+        pass
+
+    def load(self, rows):
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in dict.fromkeys(rows)),
+            ignore_conflicts=True
+        )
+
+
+class CopyLoader:
+    """Загрузка в PostgreSQL: пачка копируется командой COPY во
+    временную таблицу и переносится в справочник через
+    INSERT ... ON CONFLICT DO NOTHING."""
+
+    def prepare(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} '
+                '(name text NOT NULL, measurement_unit text NOT NULL) '
+                'ON COMMIT DELETE ROWS'
+            )
+
+    def load(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                f'FROM {STAGING_TABLE} '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+
+
+class Command(BaseCommand):
+    help = ('Потоково загружает большой справочник ингредиентов из CSV, '
+            'JSON или JSON Lines. На PostgreSQL используется COPY, '
+            'на остальных СУБД — bulk_create. Каждая пачка фиксируется '
+            'отдельно; прерванную загрузку можно продолжить с --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Строк в одной транзакции.')
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки (по умолчанию <path>.checkpoint).')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить загрузку с контрольной точки.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError(
+                f'Неизвестный формат файла {path}, '
+                f'нужен один из {", ".join(READERS)}')
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+
+        checkpoint = Checkpoint(
+            options['checkpoint'] or f'{path}.checkpoint', path)
+        done = checkpoint.load() if options['resume'] else 0
+        loader = (CopyLoader() if connection.vendor == 'postgresql'
+                  else BulkCreateLoader())
+        max_length = Ingredient._meta.get_field('name').max_length
+        batch_size = options['batch_size']
+
+        started = time.monotonic()
+        before = Ingredient.objects.count()
+        read = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                rows = islice(reader(file), done, None)
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    with transaction.atomic():
+                        loader.prepare()
+                        loader.load(list(clean_rows(batch, max_length)))
+                    read += len(batch)
+                    checkpoint.save(done + read)
+                    self.stdout.write(f'Загружено строк: {done + read}')
+        except IngredientFileError as error:
+            raise CommandError(error)
+        finally:
+            # Ни bulk_create, ни COPY не отправляют сигналы.
+            invalidate_ingredient_catalog()
+        checkpoint.remove()
+
+        elapsed = time.monotonic() - started
+        created = Ingredient.objects.count() - before
+        message = f'Загрузка завершена: прочитано строк {read}'
+        if done:
+            message += f' (пропущено {done} по контрольной точке)'
+        self.stdout.write(self.style.SUCCESS(
+            f'{message}, новых ингредиентов {created} за {elapsed:.2f} с '
+            f'({read / max(elapsed, 1e-6):.0f} строк/с)'))
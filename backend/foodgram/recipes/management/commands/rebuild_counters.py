@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe
+from users.models import Subscription, User
+
+
+def count_subquery(queryset, field):
+    """Подзапрос с количеством строк queryset, относящихся
+    к текущему объекту внешнего запроса."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики избранного у рецептов, '
+            'а также рецептов и подписчиков у пользователей.')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.update(
+            favorites_count=count_subquery(Favorite.objects, 'recipe'))
+        users = User.objects.update(
+            recipes_count=count_subquery(Recipe.objects, 'author'),
+            subscribers_count=count_subquery(
+                Subscription.objects, 'author'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны: рецептов {recipes}, '
+            f'пользователей {users}'))
@@ -0,0 +1,72 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connection
+
+from recipes.jobs import claim_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди. Задачи выполняются '
+            'в потоках: Pillow и база данных отпускают GIL, так что '
+            'обработка картинок идет параллельно.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.JOBS_CONCURRENCY,
+            help='Число задач, выполняемых одновременно.')
+        parser.add_argument(
+            '--poll-interval', type=float,
+            default=settings.JOBS_POLL_INTERVAL,
+            help='Пауза в секундах, когда очередь пуста.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить задачи, которые есть в очереди, и завершиться.')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        previous = signal.signal(signal.SIGTERM, self.stop)
+        concurrency = max(options['concurrency'], 1)
+        try:
+            if concurrency == 1:
+                succeeded, failed = self.work(options)
+            else:
+                with ThreadPoolExecutor(concurrency) as pool:
+                    futures = [pool.submit(self.work, options)
+                               for _ in range(concurrency)]
+                    results = [future.result() for future in futures]
+                succeeded = sum(result[0] for result in results)
+                failed = sum(result[1] for result in results)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено задач: {succeeded}, с ошибкой: {failed}'))
+
+    def stop(self, signum, frame):
+        self.stopping.set()
+
+    def work(self, options):
+        """Выполняет задачи, пока не остановят. Когда очередь пуста,
+        возвращает в нее задачи остановившихся воркеров: они могут
+        зависнуть в любой момент, а не только до запуска этого."""
+        succeeded = failed = 0
+        try:
+            while not self.stopping.is_set():
+                job = claim_job()
+                if job is None:
+                    if requeue_stale_jobs():
+                        continue
+                    if options['once']:
+                        break
+                    self.stopping.wait(options['poll_interval'])
+                elif run_job(job):
+                    succeeded += 1
+                else:
+                    failed += 1
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+        return succeeded, failed
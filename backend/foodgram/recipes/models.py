@@ -46,6 +46,78 @@ class Ingredient(models.Model):
                 name='unique_ingredients',
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('name',),
+                name='ingredient_name_prefix_idx',
+                opclasses=('varchar_pattern_ops',),
+            ),
+        )
+
+
+def get_recipe_prefetch_lookups():
+    """Связанные объекты, которые RecipeSerializer выводит для
+    каждого рецепта."""
+    return (
+        'tags',
+        models.Prefetch(
+            'ingredients_in',
+            queryset=IngredientInRecipe.objects.select_related('ingredient')
+        ),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Подгружает автора, тэги и ингредиенты рецептов фиксированным
+        числом запросов вне зависимости от размера выборки."""
+        return self.select_related('author').prefetch_related(
+            *get_recipe_prefetch_lookups()
+        )
+
+    def with_fieldset(self, fieldset, user):
+        """Подгружает только то, что нужно для полей fieldset:
+        нераскрытым связям достаточно идентификаторов."""
+        queryset = self
+        if 'text' not in fieldset:
+            queryset = queryset.defer('text')
+        if fieldset.expands('author'):
+            queryset = queryset.select_related('author')
+        if 'tags' in fieldset:
+            queryset = queryset.prefetch_related(
+                'tags' if fieldset.expands('tags') else models.Prefetch(
+                    'tags', queryset=Tag.objects.only('id')))
+        if 'ingredients' in fieldset:
+            ingredients = IngredientInRecipe.objects.all()
+            if fieldset.expands('ingredients'):
+                ingredients = ingredients.select_related('ingredient')
+            queryset = queryset.prefetch_related(
+                models.Prefetch('ingredients_in', queryset=ingredients))
+        if ('is_favorited' not in fieldset
+                and 'is_in_shopping_cart' not in fieldset):
+            return queryset
+        return queryset.with_user_flags(user)
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами is_favorited и is_in_shopping_cart
+        для пользователя одним запросом вместо запроса на каждый рецепт."""
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Favorite.objects.filter(
+                    user=user, recipe=models.OuterRef('pk'))
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk'))
+            ),
+        )
 
 
 class Recipe(models.Model):
@@ -76,6 +148,19 @@ class Recipe(models.Model):
     cooking_time = models.IntegerField(
         validators=[validate_integer_greater_zero]
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    derivatives_source = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        verbose_name='Картинка, для которой созданы уменьшенные копии'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -90,6 +175,18 @@ class Recipe(models.Model):
                 name='unique_recipes',
             ),
         )
+        indexes = (
+            # Рецепты автора в порядке выдачи: профиль и подписки.
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_id_idx',
+            ),
+            # Подсчет ссылок на картинку перед удалением файла.
+            models.Index(
+                fields=('image',),
+                name='recipe_image_idx',
+            ),
+        )
 
 
 class TagInRecipe(models.Model):
@@ -118,6 +215,12 @@ class TagInRecipe(models.Model):
                 name='unique_recipes_tags',
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('tag', 'recipe'),
+                name='tag_in_recipe_tag_recipe_idx',
+            ),
+        )
 
 
 class IngredientInRecipe(models.Model):
@@ -201,3 +304,44 @@ class ShoppingCart(models.Model):
                 name='unique_purchases',
             ),
         )
+
+
+class Job(models.Model):
+    """Фоновая задача. Очередь хранится в базе, задачи выбирает
+    и выполняет команда run_jobs; выполненные задачи удаляются."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Ошибка'),
+    )
+
+    task = models.CharField(max_length=100, verbose_name='Задача')
+    argument = models.CharField(
+        max_length=200, blank=True, verbose_name='Аргумент')
+    status = models.CharField(
+        max_length=10, choices=STATUSES, default=PENDING,
+        verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name='Попыток')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name='Создана')
+    started = models.DateTimeField(
+        null=True, blank=True, verbose_name='Начата')
+
+    def __str__(self):
+        return f'{self.task}({self.argument})'
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['id']
+        indexes = (
+            models.Index(
+                fields=('status', 'id'),
+                name='job_status_idx',
+            ),
+        )
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL
+    вместо полного COUNT(*)."""
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class RecipePagination(PageNumberPagination):
+    """Постраничный вывод рецептов с поддержкой keyset-пагинации.
+
+    Ответ и параметры page и limit те же, что у PageNumberPagination.
+    Если передан after (или before) — id последнего (первого) рецепта
+    предыдущей страницы, — выборка идет условием по id вместо OFFSET.
+    При RECIPES_KEYSET_PAGINATION ссылки next и previous сразу
+    содержат эти параметры, так что клиент, который просто идет
+    по ссылкам, получает keyset-пагинацию без изменений.
+
+    Точный COUNT(*) выполняется только для первых страниц
+    (до RECIPES_EXACT_COUNT_LIMIT строк); на последней странице
+    количество известно и так, а для дальних страниц на PostgreSQL
+    берется оценка планировщика.
+    """
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    after_query_param = 'after'
+    before_query_param = 'before'
+    invalid_page_message = 'Неправильная страница.'
+
+    def get_page_number_value(self, request):
+        try:
+            page_number = int(request.query_params.get(
+                self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        return page_number
+
+    def get_id_value(self, request, param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        self.page_size = page_size
+        self.page_number = self.get_page_number_value(request)
+        after = self.get_id_value(request, self.after_query_param)
+        before = self.get_id_value(request, self.before_query_param)
+        self.cursor = after is not None or before is not None
+        self.keyset = settings.RECIPES_KEYSET_PAGINATION or self.cursor
+
+        if after is not None:
+            rows = list(
+                queryset.order_by('-pk').filter(pk__lt=after)[:page_size + 1])
+            self.has_next = len(rows) > page_size
+            self.has_previous = True
+            rows = rows[:page_size]
+        elif before is not None:
+            rows = list(
+                queryset.order_by('pk').filter(pk__gt=before)[:page_size + 1])
+            self.has_previous = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            # Курсор мог указывать на удаленный или самый старый рецепт.
+            self.has_next = bool(rows) and queryset.filter(
+                pk__lt=rows[-1].pk).exists()
+        else:
+            offset = (self.page_number - 1) * page_size
+            rows = list(queryset[offset:offset + page_size + 1])
+            if not rows and self.page_number > 1:
+                raise NotFound(self.invalid_page_message)
+            self.has_next = len(rows) > page_size
+            self.has_previous = self.page_number > 1
+            rows = rows[:page_size]
+
+        self.rows = rows
+        self.count = self.get_count(queryset)
+        return rows
+
+    def get_count(self, queryset):
+        if self.cursor:
+            # Номер страницы при after и before присылает клиент, по нему
+            # нельзя судить, сколько рецептов осталось позади.
+            seen = len(self.rows) + self.has_next
+        else:
+            seen = (self.page_number - 1) * self.page_size + len(self.rows)
+            if not self.has_next:
+                return seen
+            seen += 1
+        if (self.page_number * self.page_size
+                <= settings.RECIPES_EXACT_COUNT_LIMIT
+                or connections[queryset.db].vendor != 'postgresql'):
+            return queryset.count()
+        return max(estimate_count(queryset), seen)
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        url = replace_query_param(
+            self.request.build_absolute_uri(),
+            self.page_query_param, self.page_number + 1)
+        if not self.keyset:
+            return url
+        url = remove_query_param(url, self.before_query_param)
+        return replace_query_param(
+            url, self.after_query_param, self.rows[-1].pk)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number > 2:
+            url = replace_query_param(
+                url, self.page_query_param, self.page_number - 1)
+        else:
+            url = remove_query_param(url, self.page_query_param)
+        if not self.keyset:
+            return url
+        url = remove_query_param(url, self.after_query_param)
+        if self.page_number <= 2 or not self.rows:
+            # На первую страницу возвращаемся без курсора.
+            return remove_query_param(url, self.before_query_param)
+        return replace_query_param(
+            url, self.before_query_param, self.rows[0].pk)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
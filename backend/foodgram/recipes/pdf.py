@@ -0,0 +1,440 @@
+"""Минимальный генератор PDF на чистом Python.
+
+Поддерживает только то, что нужно для списка покупок: страницы A4
+с однострочным текстом. Для кириллицы в документ встраивается
+TrueType-шрифт; если шрифт недоступен, используется стандартный
+Helvetica, и символы вне WinAnsi заменяются на «?».
+"""
+import functools
+import hashlib
+import itertools
+import os
+import re
+import struct
+import zlib
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+FONT_SIZE = 12
+LEADING = 18
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+# Таблицы, которые остаются во встроенном подмножестве шрифта: PDF
+# берет отображение символов и ширины из своих словарей, так что cmap,
+# name, post, OS/2 и таблицы кернинга не нужны.
+SUBSET_TABLES = ('cvt ', 'fpgm', 'glyf', 'head', 'hhea', 'hmtx', 'loca',
+                 'maxp', 'prep')
+# Флаги составного глифа (спецификация TrueType, таблица glyf).
+ARG_1_AND_2_ARE_WORDS = 0x0001
+WE_HAVE_A_SCALE = 0x0008
+MORE_COMPONENTS = 0x0020
+WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+
+class TrueTypeFont:
+    """Читает из TrueType-файла таблицы, нужные для встраивания
+    шрифта в PDF: метрики, ширины глифов и отображение Unicode
+    в номера глифов. subset() собирает из него шрифт только
+    с нужными глифами."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.name = re.sub(
+            r'[^A-Za-z0-9-]', '',
+            os.path.splitext(os.path.basename(path))[0]
+        ) or 'Font'
+        self.tables, self.lengths = self._read_tables()
+
+        head = self.tables['head']
+        self.units_per_em = self._unpack('>H', head + 18)[0]
+        self.bbox = [self._scale(value) for value in
+                     self._unpack('>4h', head + 36)]
+
+        hhea = self.tables['hhea']
+        ascent, descent = self._unpack('>2h', hhea + 4)
+        self.ascent = self._scale(ascent)
+        self.descent = self._scale(descent)
+        number_of_metrics = self._unpack('>H', hhea + 34)[0]
+
+        hmtx = self.tables['hmtx']
+        self.widths = [
+            self._scale(self._unpack('>H', hmtx + 4 * i)[0])
+            for i in range(number_of_metrics)
+        ]
+        self.cmap = self._read_cmap()
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def _scale(self, value):
+        return int(round(value * 1000 / self.units_per_em))
+
+    def _read_tables(self):
+        count = self._unpack('>H', 4)[0]
+        tables, lengths = {}, {}
+        for i in range(count):
+            tag, _, offset, length = self._unpack('>4sIII', 12 + 16 * i)
+            tag = tag.decode('latin-1')
+            tables[tag] = offset
+            lengths[tag] = length
+        return tables, lengths
+
+    def _table(self, tag):
+        offset = self.tables[tag]
+        return self.data[offset:offset + self.lengths[tag]]
+
+    def _read_cmap(self):
+        cmap = self.tables['cmap']
+        count = self._unpack('>H', cmap + 2)[0]
+        for i in range(count):
+            platform, encoding, offset = self._unpack(
+                '>HHI', cmap + 4 + 8 * i)
+            subtable = cmap + offset
+            if ((platform, encoding) in ((3, 1), (0, 3))
+                    and self._unpack('>H', subtable)[0] == 4):
+                return self._read_cmap_format4(subtable)
+        raise ValueError('В шрифте нет Unicode-таблицы cmap формата 4')
+
+    def _read_cmap_format4(self, offset):
+        segments = self._unpack('>H', offset + 6)[0] // 2
+        ends = offset + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+
+        mapping = {}
+        for i in range(segments):
+            end = self._unpack('>H', ends + 2 * i)[0]
+            start = self._unpack('>H', starts + 2 * i)[0]
+            delta = self._unpack('>h', deltas + 2 * i)[0]
+            range_offset_position = range_offsets + 2 * i
+            range_offset = self._unpack('>H', range_offset_position)[0]
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset == 0:
+                    glyph = (code + delta) & 0xFFFF
+                else:
+                    glyph = self._unpack(
+                        '>H',
+                        range_offset_position + range_offset
+                        + 2 * (code - start)
+                    )[0]
+                    if glyph:
+                        glyph = (glyph + delta) & 0xFFFF
+                if glyph:
+                    mapping[code] = glyph
+        return mapping
+
+    def glyph(self, char):
+        return self.cmap.get(ord(char), 0)
+
+    def width(self, glyph):
+        if glyph < len(self.widths):
+            return self.widths[glyph]
+        return self.widths[-1]
+
+    def _glyph_offsets(self):
+        number_of_glyphs = self._unpack('>H', self.tables['maxp'] + 4)[0]
+        long_offsets = self._unpack('>h', self.tables['head'] + 50)[0]
+        if long_offsets:
+            return self._unpack(f'>{number_of_glyphs + 1}I',
+                                self.tables['loca'])
+        return [offset * 2 for offset in self._unpack(
+            f'>{number_of_glyphs + 1}H', self.tables['loca'])]
+
+    def _components(self, offset):
+        """Номера глифов, из которых состоит составной глиф."""
+        if self._unpack('>h', offset)[0] >= 0:
+            return
+        position = offset + 10
+        flags = MORE_COMPONENTS
+        while flags & MORE_COMPONENTS:
+            flags, glyph = self._unpack('>HH', position)
+            yield glyph
+            position += 4
+            position += 4 if flags & ARG_1_AND_2_ARE_WORDS else 2
+            if flags & WE_HAVE_A_SCALE:
+                position += 2
+            elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+                position += 4
+            elif flags & WE_HAVE_A_TWO_BY_TWO:
+                position += 8
+
+    def subset(self, glyphs):
+        """Возвращает шрифт, в котором остались только глифы glyphs
+        (и глифы, из которых они составлены). Номера глифов не меняются,
+        остальные глифы пустые, поэтому в PDF по-прежнему подходит
+        /CIDToGIDMap /Identity."""
+        offsets = self._glyph_offsets()
+        glyf = self.tables['glyf']
+        keep = set()
+        pending = {0, *glyphs}
+        while pending:
+            glyph = pending.pop()
+            if glyph in keep or glyph >= len(offsets) - 1:
+                continue
+            keep.add(glyph)
+            if offsets[glyph + 1] > offsets[glyph]:
+                pending.update(self._components(glyf + offsets[glyph]))
+
+        outlines = bytearray()
+        loca = [0]
+        for glyph in range(len(offsets) - 1):
+            if glyph in keep:
+                outlines += self.data[glyf + offsets[glyph]:
+                                      glyf + offsets[glyph + 1]]
+                outlines += bytes(-len(outlines) % 4)
+            loca.append(len(outlines))
+
+        head = bytearray(self._table('head'))
+        struct.pack_into('>I', head, 8, 0)
+        struct.pack_into('>h', head, 50, 1)
+        tables = {tag: self._table(tag)
+                  for tag in SUBSET_TABLES if tag in self.tables}
+        tables.update(
+            head=bytes(head),
+            glyf=bytes(outlines),
+            loca=struct.pack(f'>{len(loca)}I', *loca),
+        )
+        return _build_sfnt(tables)
+
+
+def _checksum(data):
+    data = bytes(data) + bytes(-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}I', data)) & 0xFFFFFFFF
+
+
+def _build_sfnt(tables):
+    """Собирает TrueType-файл из таблиц и проставляет контрольные
+    суммы, включая checkSumAdjustment в head."""
+    count = len(tables)
+    power = 1 << (count.bit_length() - 1)
+    header = struct.pack('>IHHHH', 0x00010000, count, power * 16,
+                         power.bit_length() - 1, (count - power) * 16)
+    directory = b''
+    body = b''
+    offset = len(header) + 16 * count
+    head_offset = None
+    for tag in sorted(tables):
+        data = tables[tag]
+        if tag == 'head':
+            head_offset = offset + len(body)
+        directory += struct.pack('>4sIII', tag.encode('latin-1'),
+                                 _checksum(data), offset + len(body),
+                                 len(data))
+        body += data + bytes(-len(data) % 4)
+    font = bytearray(header + directory + body)
+    if head_offset is not None:
+        struct.pack_into('>I', font, head_offset + 8,
+                         (0xB1B0AFBA - _checksum(font)) & 0xFFFFFFFF)
+    return bytes(font)
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(path):
+    if not path or not os.path.exists(path):
+        return None
+    return TrueTypeFont(path)
+
+
+def _escape(text):
+    return (text.replace(b'\\', b'\\\\')
+                .replace(b'(', b'\\(')
+                .replace(b')', b'\\)'))
+
+
+def _stream(body, **entries):
+    compressed = zlib.compress(body)
+    extra = ''.join(f' /{key} {value}' for key, value in entries.items())
+    return (
+        f'<< /Length {len(compressed)} /Filter /FlateDecode{extra} >>\n'
+        'stream\n'
+    ).encode() + compressed + b'\nendstream'
+
+
+def _to_unicode_cmap(used):
+    lines = [
+        '/CIDInit /ProcSet findresource begin',
+        '12 dict begin',
+        'begincmap',
+        '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+        '/Supplement 0 >> def',
+        '/CMapName /Adobe-Identity-UCS def',
+        '/CMapType 2 def',
+        '1 begincodespacerange',
+        '<0000> <FFFF>',
+        'endcodespacerange',
+    ]
+    items = sorted(used.items())
+    for i in range(0, len(items), 100):
+        chunk = items[i:i + 100]
+        lines.append(f'{len(chunk)} beginbfchar')
+        for glyph, char in chunk:
+            code = char.encode('utf-16-be').hex().upper()
+            lines.append(f'<{glyph:04X}> <{code}>')
+        lines.append('endbfchar')
+    lines += [
+        'endcmap',
+        'CMapName currentdict /CMap defineresource pop',
+        'end',
+        'end',
+    ]
+    return '\n'.join(lines).encode()
+
+
+class PdfWriter:
+    """Собирает документ постранично и отдает его частями.
+
+    Номера объектов каталога, дерева страниц и шрифта резервируются
+    заранее, поэтому страницы можно выдавать по мере поступления
+    строк, а дерево страниц и шрифт дописываются в конце.
+    """
+    CATALOG = 1
+    PAGES = 2
+    FONT = 3
+
+    def __init__(self, font=None):
+        self.font = font
+        self.numbers = itertools.count(self.FONT + 1)
+        self.offsets = {}
+        self.position = 0
+        self.pages = []
+        self.used_glyphs = {}
+
+    def _reserve(self):
+        return next(self.numbers)
+
+    def _object(self, number, body):
+        if isinstance(body, str):
+            body = body.encode()
+        self.offsets[number] = self.position
+        chunk = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        self.position += len(chunk)
+        return chunk
+
+    def _header(self):
+        chunk = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position += len(chunk)
+        return chunk
+
+    def _encode_line(self, text):
+        if self.font is None:
+            encoded = text.encode('cp1252', errors='replace')
+            return b'(' + _escape(encoded) + b')'
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyph(char)
+            self.used_glyphs.setdefault(glyph, char)
+            glyphs.append(f'{glyph:04X}')
+        return f'<{"".join(glyphs)}>'.encode()
+
+    def _page(self, lines):
+        commands = [f'BT /F1 {FONT_SIZE} Tf {LEADING} TL '
+                    f'{MARGIN} {PAGE_HEIGHT - MARGIN} Td'.encode()]
+        for line in lines:
+            commands.append(self._encode_line(line) + b' Tj T*')
+        commands.append(b'ET')
+        content = self._reserve()
+        page = self._reserve()
+        self.pages.append(page)
+        yield self._object(content, _stream(b'\n'.join(commands)))
+        yield self._object(
+            page,
+            f'<< /Type /Page /Parent {self.PAGES} 0 R '
+            f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 {self.FONT} 0 R >> >> '
+            f'/Contents {content} 0 R >>'
+        )
+
+    def _standard_font(self):
+        yield self._object(
+            self.FONT,
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding /WinAnsiEncoding >>'
+        )
+
+    def _embedded_font(self):
+        font = self.font
+        data = font.subset(self.used_glyphs)
+        # Имя подмножества по PDF 1.4, 5.5.3: шесть заглавных букв и «+».
+        digest = hashlib.md5(
+            ','.join(map(str, sorted(self.used_glyphs))).encode()).digest()
+        name = ''.join(chr(ord('A') + byte % 26) for byte in digest[:6])
+        name = f'{name}+{font.name}'
+        descendant = self._reserve()
+        descriptor = self._reserve()
+        font_file = self._reserve()
+        to_unicode = self._reserve()
+
+        widths = ' '.join(
+            f'{glyph} [{font.width(glyph)}]'
+            for glyph in sorted(self.used_glyphs)
+        )
+        yield self._object(
+            self.FONT,
+            f'<< /Type /Font /Subtype /Type0 /BaseFont /{name} '
+            f'/Encoding /Identity-H /DescendantFonts [{descendant} 0 R] '
+            f'/ToUnicode {to_unicode} 0 R >>'
+        )
+        yield self._object(
+            descendant,
+            f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{name} '
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+            '/Supplement 0 >> '
+            f'/FontDescriptor {descriptor} 0 R /CIDToGIDMap /Identity '
+            f'/W [{widths}] >>'
+        )
+        bbox = ' '.join(str(value) for value in font.bbox)
+        yield self._object(
+            descriptor,
+            f'<< /Type /FontDescriptor /FontName /{name} /Flags 32 '
+            f'/FontBBox [{bbox}] /ItalicAngle 0 /Ascent {font.ascent} '
+            f'/Descent {font.descent} /CapHeight {font.ascent} /StemV 80 '
+            f'/FontFile2 {font_file} 0 R >>'
+        )
+        yield self._object(
+            font_file, _stream(data, Length1=len(data)))
+        yield self._object(
+            to_unicode, _stream(_to_unicode_cmap(self.used_glyphs)))
+
+    def _trailer(self):
+        size = max(self.offsets) + 1
+        xref = self.position
+        lines = ['xref', f'0 {size}', '0000000000 65535 f ']
+        for number in range(1, size):
+            lines.append(f'{self.offsets[number]:010d} 00000 n ')
+        lines += [
+            'trailer',
+            f'<< /Size {size} /Root {self.CATALOG} 0 R >>',
+            'startxref',
+            str(xref),
+            '%%EOF',
+            '',
+        ]
+        return '\n'.join(lines).encode()
+
+    def write(self, lines):
+        yield self._header()
+        page = []
+        for line in lines:
+            page.append(line)
+            if len(page) == LINES_PER_PAGE:
+                yield from self._page(page)
+                page = []
+        if page or not self.pages:
+            yield from self._page(page)
+
+        if self.font is None:
+            yield from self._standard_font()
+        else:
+            yield from self._embedded_font()
+        kids = ' '.join(f'{page} 0 R' for page in self.pages)
+        yield self._object(
+            self.PAGES,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>'
+        )
+        yield self._object(
+            self.CATALOG, f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>')
+        yield self._trailer()
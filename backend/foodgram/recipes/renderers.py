@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from rest_framework import renderers
+
+from .pdf import PdfWriter, load_font
+
+SHOPPING_CART_RENDERERS = []
+
+
+def register_shopping_cart_renderer(renderer_class):
+    """Добавляет формат в список доступных для скачивания
+    списка покупок. Формат выбирается по ?format= или Accept."""
+    SHOPPING_CART_RENDERERS.append(renderer_class)
+    return renderer_class
+
+
+class ShoppingCartRenderer(renderers.BaseRenderer):
+    """Базовый класс форматов списка покупок.
+
+    Строки списка приходят словарями с ключами name,
+    measurement_unit и total_amount; наследники отдают документ
+    частями из render_rows().
+    """
+    charset = 'utf-8'
+
+    def render_rows(self, rows):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответы об ошибках DRF рендерит тем же классом.
+            return str(data.get('detail', data)).encode('utf-8')
+        return b''.join(self.render_rows(data))
+
+
+@register_shopping_cart_renderer
+class TextShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render_rows(self, rows):
+        for row in rows:
+            yield (
+                f'* {row["name"]} ({row["measurement_unit"]}) '
+                f'- {row["total_amount"]}\n'
+            ).encode(self.charset)
+
+
+@register_shopping_cart_renderer
+class CsvShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('name', 'measurement_unit', 'amount')
+
+    def render_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.header)
+        for row in rows:
+            writer.writerow(
+                (row['name'], row['measurement_unit'], row['total_amount']))
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode(self.charset)
+
+
+@register_shopping_cart_renderer
+class JsonShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render_rows(self, rows):
+        yield b'['
+        for i, row in enumerate(rows):
+            item = json.dumps({
+                'name': row['name'],
+                'measurement_unit': row['measurement_unit'],
+                'amount': row['total_amount'],
+            }, ensure_ascii=False)
+            yield (',' if i else '').encode() + item.encode('utf-8')
+        yield b']'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return json.dumps(data, ensure_ascii=False).encode('utf-8')
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+@register_shopping_cart_renderer
+class PdfShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+    def render_rows(self, rows):
+        font = load_font(settings.SHOPPING_CART_PDF_FONT)
+        lines = (
+            f'* {row["name"]} ({row["measurement_unit"]}) '
+            f'- {row["total_amount"]}'
+            for row in rows
+        )
+        return PdfWriter(font).write(lines)
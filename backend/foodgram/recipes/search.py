@@ -0,0 +1,71 @@
+"""Поиск ингредиентов по началу названия для подсказок при вводе.
+
+Совпадения по префиксу берутся из каталога в памяти процесса
+(см. recipes.catalog). Если в PostgreSQL установлено расширение
+pg_trgm, к ним добавляются похожие названия, отсортированные по
+триграммной близости.
+"""
+import functools
+import logging
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import DatabaseError, connection, connections
+
+from .catalog import get_ingredient_catalog
+from .models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_INDEX_NAME = 'ingredient_name_trgm_idx'
+
+
+@functools.lru_cache(maxsize=None)
+def trigram_available():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_index(using='default', **kwargs):
+    """Создает расширение pg_trgm и GIN-индекс по названию
+    ингредиента. Вызывается после migrate; на других СУБД
+    ничего не делает."""
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    table = Ingredient._meta.db_table
+    try:
+        with db.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} '
+                f'ON {table} USING gin (name gin_trgm_ops)'
+            )
+    except DatabaseError:
+        logger.warning(
+            'Не удалось включить pg_trgm, поиск ингредиентов '
+            'будет только по префиксу', exc_info=True)
+    trigram_available.cache_clear()
+
+
+def search_ingredients(query, limit=None):
+    """Подсказки по названию ингредиента: сначала совпадения по
+    началу названия из каталога в памяти, затем, если есть pg_trgm,
+    похожие названия из базы."""
+    if limit is None:
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+    result = get_ingredient_catalog().search(query, limit)
+    if (len(result) >= limit or connection.vendor != 'postgresql'
+            or not trigram_available()):
+        return result
+
+    similar = Ingredient.objects.filter(
+        name__trigram_similar=query
+    ).exclude(
+        pk__in=[ingredient.pk for ingredient in result]
+    ).annotate(
+        similarity=TrigramSimilarity('name', query)
+    ).order_by('-similarity', 'name')[:limit - len(result)]
+    return result + list(similar)
@@ -1,15 +1,21 @@
-import base64
-
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
 from users.serializers import UserSerializer
+from .catalog import get_ingredient_catalog
+from .fieldsets import SparseFieldsetSerializerMixin
+from .images import (ImageDecodeError, decode_data_uri, derivatives_ready,
+                     get_image_urls, release_image_on_commit,
+                     schedule_recipe_derivatives, store_image)
 from .models import (Favorite,
                      Ingredient,
                      IngredientInRecipe,
                      Recipe,
                      Tag,
-                     TagInRecipe)
+                     TagInRecipe,
+                     get_recipe_prefetch_lookups)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -35,21 +41,51 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class IngredientAmountSerializer(serializers.ModelSerializer):
+    """Ингредиент рецепта без названия и единиц измерения."""
+    id = serializers.ReadOnlyField(source='ingredient_id')
+
+    class Meta:
+        model = IngredientInRecipe
+        fields = ('id', 'amount')
+
+
+class RecipeSerializer(SparseFieldsetSerializerMixin,
+                       serializers.ModelSerializer):
+    expandable_fields = ('author', 'tags', 'ingredients')
+
     tags = TagSerializer(many=True)
     author = UserSerializer()
     ingredients = IngredientInRecipeSerializer(
         source='ingredients_in', many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+    images_status = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'images', 'images_status', 'text',
+                  'cooking_time')
+
+    def get_collapsed_field(self, name):
+        if name == 'ingredients':
+            return IngredientAmountSerializer(
+                source='ingredients_in', many=True)
+        return serializers.PrimaryKeyRelatedField(
+            many=(name == 'tags'), read_only=True)
+
+    def get_images(self, instance):
+        return get_image_urls(instance, self.context.get('request'))
+
+    def get_images_status(self, instance):
+        return 'ready' if derivatives_ready(instance) else 'processing'
 
     def get_is_favorited(self, instance):
+        if hasattr(instance, 'is_favorited'):
+            return instance.is_favorited
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -58,6 +94,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         ).exists()
 
     def get_is_in_shopping_cart(self, instance):
+        if hasattr(instance, 'is_in_shopping_cart'):
+            return instance.is_in_shopping_cart
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -94,15 +132,28 @@ class TagSerializer2(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'invalid_base64': 'Некорректное изображение в base64.',
+        'too_large': 'Размер изображения не должен превышать {max_size} Мб.',
+        'unknown_format': ('Неподдерживаемый формат изображения, '
+                           'допустимы PNG, JPEG, GIF и WebP.'),
+    }
+
+    def fail(self, key, **kwargs):
+        super().fail(key, max_size=round(
+            settings.RECIPE_IMAGE_MAX_SIZE / 1024 / 1024, 1), **kwargs)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(
-                base64.b64decode(imgstr),
-                name='temp.' + ext
-            )
-        return super().to_internal_value(data)
+            try:
+                data = decode_data_uri(data)
+            except ImageDecodeError as error:
+                self.fail(error.code)
+        image = super().to_internal_value(data)
+        # Картинки из multipart-запроса ограничены тем же размером.
+        if image.size > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large')
+        return image
 
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
@@ -118,6 +169,7 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
                   'image', 'text', 'cooking_time')
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], *get_recipe_prefetch_lookups())
         serializer = RecipeSerializer(
             instance,
             context={
@@ -127,7 +179,7 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         return serializer.data
 
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = self.initial_data.get('ingredients', [])
         lst = []
 
         for i in ingredients:
@@ -139,43 +191,122 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
         return data
 
+    def validate_ingredients(self, value):
+        ids = [item['id'] for item in value]
+        ingredients = get_ingredient_catalog().in_bulk(ids)
+        missing = [pk for pk in ids if pk not in ingredients]
+        if missing:
+            # Ингредиент мог появиться в другом процессе, который
+            # еще не сбросил каталог этого процесса.
+            ingredients.update(Ingredient.objects.in_bulk(missing))
+            missing = [pk for pk in missing if pk not in ingredients]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиентов с id {missing} не существует!'
+            )
+        for item in value:
+            item['ingredient'] = ingredients[item['id']]
+        return value
+
     def create_ingredients(self, ingredients, recipe):
-        for i in ingredients:
-            ingredient = Ingredient.objects.get(pk=i['id'])
-            IngredientInRecipe.objects.create(
-                ingredient=ingredient, recipe=recipe, amount=i['amount']
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                ingredient=item['ingredient'],
+                recipe=recipe,
+                amount=item['amount']
             )
+            for item in ingredients
+        )
 
     def create_tags(self, tags, recipe):
         recipe.tags.set(tags)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
 
         user = self.context.get('request').user
+        validated_data['image'] = store_image(validated_data['image'])
         recipe = Recipe.objects.create(**validated_data, author=user)
         self.create_ingredients(ingredients, recipe)
         self.create_tags(tags, recipe)
+        schedule_recipe_derivatives(recipe)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        """Приводит ингредиенты рецепта к переданному списку,
+        затрагивая только изменившиеся строки."""
+        current = {item.ingredient_id: item
+                   for item in recipe.ingredients_in.all()}
+        submitted = {item['ingredient'].id: item for item in ingredients}
+
+        removed = current.keys() - submitted.keys()
+        if removed:
+            IngredientInRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+
+        changed = []
+        for ingredient_id, item in submitted.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != item['amount']:
+                row.amount = item['amount']
+                changed.append(row)
+        IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+
+        self.create_ingredients(
+            [item for ingredient_id, item in submitted.items()
+             if ingredient_id not in current],
+            recipe
+        )
+
+    def update_tags(self, tags, recipe):
+        current = {tag.id for tag in recipe.tags.all()}
+        submitted = {tag.id for tag in tags}
+
+        removed = current - submitted
+        if removed:
+            TagInRecipe.objects.filter(
+                recipe=recipe, tag_id__in=removed).delete()
+        TagInRecipe.objects.bulk_create(
+            TagInRecipe(recipe=recipe, tag_id=tag_id)
+            for tag_id in submitted - current
+        )
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Хранилище может переместить временный файл картинки,
+            # поэтому закрываем его явно, как Django после запроса.
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        TagInRecipe.objects.filter(recipe=instance).delete()
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
 
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
-        instance.image = validated_data.get('image', instance.image)
+        old_image = instance.image.name
+        if 'image' in validated_data:
+            # Та же картинка получит то же имя и не будет записана.
+            instance.image = store_image(validated_data['image'])
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
-
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-
-        self.create_ingredients(ingredients, instance)
-        self.create_tags(tags, instance)
-
-        instance.save()
+        # Счетчики и derivatives_source меняются в обход этого объекта,
+        # поэтому сохраняем только поля, которые меняет сериализатор.
+        instance.save(update_fields=('name', 'text', 'image', 'cooking_time'))
+        if instance.image.name != old_image:
+            schedule_recipe_derivatives(instance)
+            release_image_on_commit(old_image)
+
+        if ingredients is not None:
+            self.update_ingredients(ingredients, instance)
+        if tags is not None:
+            self.update_tags(tags, instance)
 
         return instance
 
@@ -187,6 +318,11 @@ class FavoriteSerializer(serializers.ModelSerializer):
 
 
 class RecipeForFavoriteSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
+
+    def get_images(self, instance):
+        return get_image_urls(instance, self.context.get('request'))
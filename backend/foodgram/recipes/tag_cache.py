@@ -0,0 +1,66 @@
+"""Кеширование списка тэгов.
+
+Тэгов немного, и меняются они только через админку, поэтому
+сериализованный список хранится в кеше Django целиком, а ответы
+снабжаются ETag, Last-Modified и Cache-Control, чтобы nginx и браузер
+могли не обращаться к бэкенду.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .models import Tag
+
+TAGS_VERSION_KEY = 'tags_version'
+TAGS_KEY = 'tags:{version}'
+
+
+def get_tags_version():
+    """Возвращает версию списка тэгов и время ее появления."""
+    return cache.get_or_set(
+        TAGS_VERSION_KEY,
+        lambda: {'id': uuid.uuid4().hex, 'modified': int(time.time())},
+        timeout=None
+    )
+
+
+def invalidate_tags():
+    cache.delete(TAGS_VERSION_KEY)
+
+
+def get_tags_data(version, serializer_class):
+    key = TAGS_KEY.format(version=version['id'])
+    data = cache.get(key)
+    if data is None:
+        data = [dict(item) for item in
+                serializer_class(Tag.objects.all(), many=True).data]
+        cache.set(key, data, timeout=None)
+    return data
+
+
+def tags_response(request, view, build):
+    """Отдает ответ view из кешированного списка тэгов.
+
+    build получает список сериализованных тэгов и возвращает
+    Response. Если клиент прислал актуальные If-None-Match или
+    If-Modified-Since, отдается 304 без тела.
+    """
+    version = get_tags_version()
+    renderer = request.accepted_renderer
+    etag = quote_etag(f'{version["id"]}-{renderer.format}')
+    last_modified = version['modified']
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build(get_tags_data(version, view.get_serializer_class()))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = (
+        f'public, max-age={settings.TAGS_CACHE_MAX_AGE}')
+    patch_vary_headers(response, ('Accept',))
+    return response
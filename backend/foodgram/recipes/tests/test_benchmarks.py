@@ -0,0 +1,313 @@
+"""Замеры числа запросов, времени и размера ответов для всех
+эндпоинтов API на большом наборе данных.
+
+Результаты сравниваются с benchmark_baseline.json:
+- число запросов не должно превышать базовое на любом объеме данных,
+  так что регрессия N+1 ловится и на маленьком наборе;
+- размер ответа сравнивается, только если объем данных совпадает
+  с тем, на котором снят базовый замер;
+- время проверяется, только если задана BENCHMARK_TIME_TOLERANCE
+  (допустимое отношение к базовому), так как оно зависит от машины.
+
+Переменные окружения:
+BENCHMARK_SCALE — множитель объема данных (1 — тысяча пользователей,
+две тысячи рецептов);
+BENCHMARK_UPDATE_BASELINE=1 — перезаписать базовый замер;
+BENCHMARK_REPORT — путь, куда сохранить отчет в JSON.
+"""
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from users.models import Subscription, User
+from ..models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                      ShoppingCart, Tag, TagInRecipe)
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__), 'benchmark_baseline.json')
+SCALE = float(os.getenv('BENCHMARK_SCALE', default=1))
+REPEAT = 3
+SIZE_TOLERANCE = 1.1
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAf'
+    'FcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+# Эндпоинты из read_endpoints, доступные без авторизации: для
+# анонима флаги избранного, корзины и подписки не запрашиваются,
+# это отдельная ветка кода.
+ANONYMOUS_ENDPOINTS = (
+    'tags-list', 'ingredients-list', 'recipes-list', 'recipes-list-deep',
+    'recipes-list-grid', 'recipes-detail', 'users-list',
+)
+
+
+def scaled(count):
+    return max(int(count * SCALE), 1)
+
+
+def seed():
+    """Наполняет базу: пользователи, рецепты с тэгами и
+    ингредиентами, избранное, корзины и подписки."""
+    User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@mail.ru',
+             first_name='Имя', last_name='Фамилия', password='!')
+        for i in range(scaled(1000))
+    )
+    users = list(User.objects.order_by('id'))
+    Tag.objects.bulk_create(
+        Tag(name=name, color=color, slug=slug) for name, color, slug in (
+            ('Завтрак', '#0076FF', 'breakfast'),
+            ('Обед', '#FFCE26', 'lunch'),
+            ('Ужин', '#9922C8', 'dinner'),
+        )
+    )
+    tags = list(Tag.objects.order_by('id'))
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+        for i in range(scaled(2000))
+    )
+    ingredients = list(Ingredient.objects.order_by('id'))
+    Recipe.objects.bulk_create(
+        Recipe(author=users[i % len(users)], name=f'Рецепт {i}',
+               image='recipes/image.jpeg', text='Текст', cooking_time=10)
+        for i in range(scaled(2000))
+    )
+    recipes = list(Recipe.objects.order_by('id'))
+    TagInRecipe.objects.bulk_create(
+        TagInRecipe(recipe=recipe, tag=tags[(i + j) % len(tags)])
+        for i, recipe in enumerate(recipes) for j in range(2)
+    )
+    IngredientInRecipe.objects.bulk_create(
+        IngredientInRecipe(
+            recipe=recipe,
+            ingredient=ingredients[(i * 5 + j) % len(ingredients)],
+            amount=j + 1)
+        for i, recipe in enumerate(recipes) for j in range(5)
+    )
+    Favorite.objects.bulk_create(
+        Favorite(user=user, recipe=recipes[(i * 7 + j) % len(recipes)])
+        for i, user in enumerate(users) for j in range(10)
+    )
+    ShoppingCart.objects.bulk_create(
+        ShoppingCart(user=user, recipe=recipes[(i * 3 + j) % len(recipes)])
+        for i, user in enumerate(users) for j in range(5)
+    )
+    Subscription.objects.bulk_create(
+        Subscription(subscriber=user, author=users[(i + j) % len(users)])
+        for i, user in enumerate(users) for j in range(1, 6)
+    )
+    # bulk_create не отправляет сигналы, счетчики заполняем командой.
+    call_command('rebuild_counters', stdout=StringIO())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class EndpointBenchmarkTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+        cls.user = User.objects.create_user(
+            username='bench', email='bench@mail.ru', first_name='Имя',
+            last_name='Фамилия', password='BENCHMARK_PASSWORD')
+        users = list(User.objects.exclude(pk=cls.user.pk).order_by('id'))
+        recipes = list(Recipe.objects.order_by('id')[:20])
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=cls.user, author=author)
+            for author in users[:10])
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe) for recipe in recipes)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes)
+        cls.author = users[-1]
+        cls.recipe = Recipe.objects.order_by('id').first()
+        cls.ingredients = list(Ingredient.objects.order_by('id')[:5])
+        cls.tags = list(Tag.objects.order_by('id'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recipe_payload(self, name):
+        return {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients
+            ],
+            'tags': [tag.id for tag in self.tags[:2]],
+            'image': IMAGE,
+            'name': name,
+            'text': 'Текст',
+            'cooking_time': 15,
+        }
+
+    def read_endpoints(self):
+        recipe = self.recipe.id
+        return {
+            'tags-list': ('get', reverse('recipes:tags-list'), None),
+            'tags-detail': ('get', reverse(
+                'recipes:tags-detail', kwargs={'id': self.tags[0].id}),
+                None),
+            'ingredients-list': (
+                'get', reverse('recipes:ingredients-list'), None),
+            'ingredients-search': (
+                'get', reverse('recipes:ingredients-list') + '?name=ингр',
+                None),
+            'ingredients-detail': ('get', reverse(
+                'recipes:ingredients-detail',
+                kwargs={'id': self.ingredients[0].id}), None),
+            'recipes-list': ('get', reverse('recipes:recipes-list'), None),
+            'recipes-list-deep': (
+                'get', reverse('recipes:recipes-list') + '?page=50', None),
+            'recipes-list-filtered': (
+                'get', reverse('recipes:recipes-list')
+                + '?tags=breakfast&tags=lunch&is_favorited=1', None),
+            'recipes-list-grid': (
+                'get', reverse('recipes:recipes-list')
+                + '?fields=id,name,image,images,cooking_time', None),
+            'recipes-detail': ('get', reverse(
+                'recipes:recipes-detail', kwargs={'id': recipe}), None),
+            'recipes-download-shopping-cart': (
+                'get', reverse('recipes:recipes-download-shopping-cart'),
+                None),
+            'users-list': ('get', reverse('users:users-list'), None),
+            'users-detail': ('get', reverse(
+                'users:users-detail', kwargs={'id': self.author.id}), None),
+            'users-me': ('get', reverse('users:users-me'), None),
+            'users-subscriptions': (
+                'get', reverse('users:users-subscriptions')
+                + '?recipes_limit=3', None),
+        }
+
+    def write_endpoints(self):
+        recipe = self.recipe.id
+        author = self.author.id
+        favorite = reverse('recipes:recipes-favorite', kwargs={'id': recipe})
+        cart = reverse('recipes:recipes-shopping-cart', kwargs={'id': recipe})
+        subscribe = reverse('users:users-subscribe', kwargs={'id': author})
+        # Запросы выполняются по порядку и зависят друг от друга.
+        return (
+            ('auth-login', 'post', reverse('users:login'),
+             {'email': 'bench@mail.ru', 'password': 'BENCHMARK_PASSWORD'}),
+            ('recipes-create', 'post', reverse('recipes:recipes-list'),
+             self.recipe_payload('Новый рецепт')),
+            ('recipes-favorite-delete', 'delete', favorite, None),
+            ('recipes-favorite-create', 'post', favorite, None),
+            ('recipes-shopping-cart-delete', 'delete', cart, None),
+            ('recipes-shopping-cart-create', 'post', cart, None),
+            ('users-subscribe', 'post', subscribe + '?recipes_limit=3', None),
+            ('users-unsubscribe', 'delete', subscribe, None),
+            ('users-set-password', 'post',
+             reverse('users:users-set-password'),
+             {'current_password': 'BENCHMARK_PASSWORD',
+              'new_password': 'BENCHMARK_PASSWORD_2'}),
+        )
+
+    def measure(self, method, url, data, client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, format='json')
+            elapsed = time.perf_counter() - started
+        self.assertLess(
+            response.status_code, status.HTTP_400_BAD_REQUEST,
+            f'{method.upper()} {url}: {response.content[:200]}')
+        return {
+            'queries': len(queries),
+            'time_ms': round(elapsed * 1000, 2),
+            'size': len(response.content),
+        }
+
+    def measure_read(self, method, url, data, client=None):
+        # Первый запрос прогревает кеши (тэги, каталог, списки
+        # покупок); замеряются повторные.
+        self.measure(method, url, data, client)
+        runs = [self.measure(method, url, data, client)
+                for _ in range(REPEAT)]
+        return dict(
+            runs[-1],
+            time_ms=statistics.median(run['time_ms'] for run in runs))
+
+    def run_benchmarks(self):
+        results = {}
+        read_endpoints = self.read_endpoints()
+        for name, (method, url, data) in read_endpoints.items():
+            results[name] = self.measure_read(method, url, data)
+
+        anonymous = APIClient()
+        for name in ANONYMOUS_ENDPOINTS:
+            method, url, data = read_endpoints[name]
+            results[f'{name}-anonymous'] = self.measure_read(
+                method, url, data, anonymous)
+        results['users-create'] = self.measure(
+            'post', reverse('users:users-list'),
+            {'email': 'new@mail.ru', 'username': 'new', 'first_name': 'Имя',
+             'last_name': 'Фамилия', 'password': 'BENCHMARK_PASSWORD'},
+            anonymous)
+
+        for name, method, url, data in self.write_endpoints():
+            results[name] = self.measure(method, url, data)
+
+        recipe = Recipe.objects.get(author=self.user, name='Новый рецепт')
+        url = reverse('recipes:recipes-detail', kwargs={'id': recipe.id})
+        payload = self.recipe_payload('Обновленный рецепт')
+        payload['ingredients'] = payload['ingredients'][1:]
+        results['recipes-update'] = self.measure('patch', url, payload)
+        results['recipes-delete'] = self.measure('delete', url, None)
+
+        results['auth-logout'] = self.measure(
+            'post', reverse('users:logout'), None)
+        return results
+
+    def test_endpoints_against_baseline(self):
+        """Проверяем, что ни один эндпоинт не стал делать больше
+        запросов, чем в базовом замере."""
+        results = self.run_benchmarks()
+        report = {'scale': SCALE, 'endpoints': results}
+
+        if os.getenv('BENCHMARK_REPORT'):
+            with open(os.getenv('BENCHMARK_REPORT'), 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+        if os.getenv('BENCHMARK_UPDATE_BASELINE') == '1':
+            with open(BASELINE_PATH, 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.skipTest('Базовый замер обновлен')
+
+        with open(BASELINE_PATH) as file:
+            baseline = json.load(file)
+        tolerance = os.getenv('BENCHMARK_TIME_TOLERANCE')
+        same_scale = baseline['scale'] == SCALE
+        self.assertEqual(
+            sorted(results), sorted(baseline['endpoints']),
+            'Набор эндпоинтов изменился, обновите базовый замер')
+        for name, result in results.items():
+            expected = baseline['endpoints'][name]
+            with self.subTest(endpoint=name):
+                self.assertLessEqual(result['queries'], expected['queries'])
+                if same_scale:
+                    self.assertLessEqual(
+                        result['size'], expected['size'] * SIZE_TOLERANCE)
+                if tolerance:
+                    self.assertLessEqual(
+                        result['time_ms'],
+                        expected['time_ms'] * float(tolerance))
@@ -0,0 +1,312 @@
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from users.models import Subscription, User
+from ..images import derivative_name
+from ..jobs import TASKS, enqueue
+from ..management.commands.import_ingredients import Checkpoint
+from ..models import Favorite, Ingredient, Job, Recipe, Tag
+
+
+class CleanShoppingCartsTest(TestCase):
+    def test_clean_shopping_carts(self):
+        """Проверяем, что команда удаляет сохраненные списки покупок
+        и не трогает остальные медиафайлы."""
+        with tempfile.TemporaryDirectory() as media_root:
+            cart_path = os.path.join(
+                media_root, 'recipes', 'shopping_cart', 'test_user')
+            os.makedirs(cart_path)
+            for name in ('1.txt', '2.txt'):
+                with open(os.path.join(cart_path, name), 'w') as f:
+                    f.write('* Яйцо (шт) - 1\n')
+            image = os.path.join(media_root, 'recipes', 'image.jpeg')
+            open(image, 'w').close()
+
+            out = StringIO()
+            with override_settings(MEDIA_ROOT=media_root):
+                call_command('clean_shopping_carts', stdout=out)
+
+            self.assertIn('2', out.getvalue())
+            self.assertFalse(os.path.exists(
+                os.path.join(media_root, 'recipes', 'shopping_cart')))
+            self.assertTrue(os.path.exists(image))
+
+
+class RebuildCountersTest(TestCase):
+    def test_rebuild_counters(self):
+        """Проверяем, что команда восстанавливает разъехавшиеся
+        счетчики по фактическим данным."""
+        author = User.objects.create_user(
+            username='author', email='author@yandex.ru', password='pass')
+        reader = User.objects.create_user(
+            username='reader', email='reader@yandex.ru', password='pass')
+        recipe = Recipe.objects.create(
+            author=author,
+            name='Рецепт',
+            image='recipes/image.jpeg',
+            text='Текст',
+            cooking_time=5
+        )
+        Favorite.objects.create(user=reader, recipe=recipe)
+        Subscription.objects.create(author=author, subscriber=reader)
+
+        Recipe.objects.update(favorites_count=10)
+        User.objects.update(recipes_count=10, subscribers_count=10)
+        call_command('rebuild_counters', stdout=StringIO())
+
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        reader.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(
+            (author.recipes_count, author.subscribers_count), (1, 1))
+        self.assertEqual(
+            (reader.recipes_count, reader.subscribers_count), (0, 0))
+
+
+class DbScriptTest(TestCase):
+    def test_import_bundled_data(self):
+        """Проверяем, что команда загружает CSV и JSON без дублей
+        и не трогает уже существующие ингредиенты."""
+        Ingredient.objects.create(
+            name='абрикосовое варенье', measurement_unit='г')
+        out = StringIO()
+        call_command('db_script', batch_size=500, stdout=out)
+        self.assertEqual(Ingredient.objects.count(), 2188)
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertIn('строк/с', out.getvalue())
+
+        path = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)),
+            'data', 'ingredients.json')
+        call_command('db_script', path, stdout=out)
+        self.assertEqual(Ingredient.objects.count(), 2188)
+
+    def test_deduplicates_rows(self):
+        """Проверяем, что повторы внутри файла загружаются один раз."""
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', encoding='utf-8') as file:
+            file.write('соль,г\n соль ,г\nсоль,щепотка\n')
+            file.flush()
+            call_command('db_script', file.name, stdout=StringIO())
+        self.assertEqual(Ingredient.objects.filter(name='соль').count(), 2)
+
+
+class ImportExportIngredientsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_formats(self):
+        """Проверяем загрузку CSV, JSON и JSON Lines пачками без дублей
+        и с отбрасыванием пустых строк."""
+        csv_path = self.write(
+            'catalog.csv', 'соль,г\nсахар,г\nсоль,г\n,г\nперец,г\n')
+        json_path = self.write(
+            'catalog.json',
+            '[{"name": "соль", "measurement_unit": "г"}, '
+            '{"name": "мука", "measurement_unit": "кг"}]')
+        jsonl_path = self.write(
+            'catalog.jsonl',
+            '{"name": "молоко", "measurement_unit": "мл"}\n\n')
+
+        for path in (csv_path, json_path, jsonl_path):
+            call_command('import_ingredients', path, batch_size=2,
+                         stdout=StringIO())
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list('name', flat=True)),
+            ['молоко', 'мука', 'перец', 'сахар', 'соль']
+        )
+        self.assertFalse(os.path.exists(f'{csv_path}.checkpoint'))
+
+    def test_resume_from_checkpoint(self):
+        """Проверяем, что с --resume строки до контрольной точки
+        пропускаются, а контрольная точка другого файла отвергается."""
+        path = self.write('catalog.csv', 'соль,г\nсахар,г\nперец,г\n')
+        checkpoint = os.path.join(self.directory.name, 'state.json')
+        Checkpoint(checkpoint, path).save(2)
+
+        call_command('import_ingredients', path, checkpoint=checkpoint,
+                     resume=True, stdout=StringIO())
+        self.assertEqual(
+            list(Ingredient.objects.values_list('name', flat=True)),
+            ['перец']
+        )
+        self.assertFalse(os.path.exists(checkpoint))
+
+        other = self.write('other.csv', 'мука,кг\n')
+        Checkpoint(checkpoint, path).save(1)
+        with self.assertRaises(CommandError):
+            call_command('import_ingredients', other,
+                         checkpoint=checkpoint, resume=True,
+                         stdout=StringIO())
+
+    def test_export_round_trip(self):
+        """Проверяем, что выгрузка в каждом формате загружается
+        обратно без потерь."""
+        Ingredient.objects.create(name='соль, крупная', measurement_unit='г')
+        Ingredient.objects.create(name='"сахар"', measurement_unit='г')
+        expected = list(Ingredient.objects.order_by('pk').values_list(
+            'name', 'measurement_unit'))
+
+        for extension in ('csv', 'json', 'jsonl'):
+            with self.subTest(format=extension):
+                path = os.path.join(
+                    self.directory.name, f'export.{extension}')
+                call_command('export_ingredients', path, stderr=StringIO())
+                Ingredient.objects.all().delete()
+                call_command('import_ingredients', path, stdout=StringIO())
+                self.assertEqual(
+                    list(Ingredient.objects.order_by('pk').values_list(
+                        'name', 'measurement_unit')),
+                    expected
+                )
+
+        out = StringIO()
+        call_command('export_ingredients', stdout=out)
+        self.assertEqual(
+            out.getvalue(), '"соль, крупная",г\n"""сахар""",г\n')
+
+
+class GenerateRecipeImagesTest(TestCase):
+    def test_generate_recipe_images(self):
+        """Проверяем, что команда создает копии только для рецептов,
+        у которых их еще нет, и пропускает отсутствующие картинки."""
+        author = User.objects.create_user(
+            username='author', email='author@yandex.ru', password='pass')
+        with tempfile.TemporaryDirectory() as media_root:
+            os.makedirs(os.path.join(media_root, 'recipes'))
+            Image.new('RGB', (800, 400)).save(
+                os.path.join(media_root, 'recipes', 'image.png'))
+            # bulk_create не отправляет сигналы, как и старые данные
+            # не проходили через генерацию копий.
+            Recipe.objects.bulk_create(
+                Recipe(author=author, name=name, image=image, text='Текст',
+                       cooking_time=5)
+                for name, image in (('Рецепт', 'recipes/image.png'),
+                                    ('Без файла', 'recipes/missing.png'))
+            )
+
+            out, again = StringIO(), StringIO()
+            with override_settings(MEDIA_ROOT=media_root):
+                call_command('generate_recipe_images', stdout=out)
+                call_command('generate_recipe_images', stdout=again)
+            self.assertIn('созданы для 1 рецептов, пропущено 1',
+                          out.getvalue())
+            self.assertIn('созданы для 0 рецептов, пропущено 1',
+                          again.getvalue())
+            self.assertTrue(os.path.exists(os.path.join(
+                media_root, 'recipes', 'derivatives',
+                'image.png-feed.webp')))
+            self.assertEqual(
+                Recipe.objects.get(name='Рецепт').derivatives_source,
+                'recipes/image.png')
+
+    def test_generate_recipe_images_same_stem(self):
+        """Проверяем, что картинки с одинаковым именем, но разным
+        расширением получают разные копии."""
+        author = User.objects.create_user(
+            username='author', email='author@yandex.ru', password='pass')
+        with tempfile.TemporaryDirectory() as media_root:
+            os.makedirs(os.path.join(media_root, 'recipes'))
+            for name, color in (('temp.png', 'red'), ('temp.jpeg', 'blue')):
+                Image.new('RGB', (800, 400), color).save(
+                    os.path.join(media_root, 'recipes', name))
+                Recipe.objects.bulk_create([Recipe(
+                    author=author, name=name, image=f'recipes/{name}',
+                    text='Текст', cooking_time=5)])
+
+            with override_settings(MEDIA_ROOT=media_root):
+                call_command('generate_recipe_images', stdout=StringIO())
+                colors = {}
+                for recipe in Recipe.objects.all():
+                    name = derivative_name(recipe.image.name, 'feed', 'jpeg')
+                    with recipe.image.storage.open(name) as file:
+                        colors[recipe.name] = Image.open(file).getpixel(
+                            (0, 0))
+            self.assertGreater(colors['temp.png'][0], 200)
+            self.assertGreater(colors['temp.jpeg'][2], 200)
+
+
+class RunJobsTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = mock.patch.dict(TASKS, {
+            'test.record': self.calls.append,
+            'test.fail': self.fail_task,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail_task(self, argument):
+        raise ValueError(argument)
+
+    def test_run_jobs(self):
+        """Проверяем, что воркер выполняет задачи по порядку и удаляет
+        их, а упавшую задачу повторяет JOBS_MAX_ATTEMPTS раз."""
+        for argument in ('1', '2', '3'):
+            enqueue('test.record', argument)
+        enqueue('test.fail', 'ошибка')
+
+        out = StringIO()
+        with self.assertLogs('recipes.jobs', 'ERROR'):
+            with override_settings(JOBS_MAX_ATTEMPTS=2):
+                call_command(
+                    'run_jobs', once=True, concurrency=1, stdout=out)
+
+        self.assertEqual(self.calls, ['1', '2', '3'])
+        self.assertIn('Выполнено задач: 3, с ошибкой: 2', out.getvalue())
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('ValueError', job.error)
+
+    def test_requeue_stale_jobs(self):
+        """Проверяем, что задача зависшего воркера возвращается
+        в очередь и выполняется снова."""
+        job = enqueue('test.record', 'зависла')
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING,
+            started=timezone.now() - timedelta(hours=1))
+
+        call_command('run_jobs', once=True, concurrency=1, stdout=StringIO())
+
+        self.assertEqual(self.calls, ['зависла'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_requeue_jobs_stale_while_working(self):
+        """Проверяем, что воркер подбирает задачу, которая зависла
+        у другого воркера уже после его запуска."""
+        def hang_other_job(argument):
+            Job.objects.filter(task='test.record').update(
+                status=Job.RUNNING,
+                started=timezone.now() - timedelta(hours=1))
+
+        enqueue('test.record', 'зависла')
+        Job.objects.update(status=Job.RUNNING, started=timezone.now())
+
+        with mock.patch.dict(TASKS, {'test.hang': hang_other_job}):
+            enqueue('test.hang')
+            call_command(
+                'run_jobs', once=True, concurrency=1, stdout=StringIO())
+
+        self.assertEqual(self.calls, ['зависла'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            enqueue('test.unknown')
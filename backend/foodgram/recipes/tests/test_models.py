@@ -1,6 +1,15 @@
-from django.test import TestCase
+import os
+import tempfile
 
-from ..models import Ingredient, Tag
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from users.models import Subscription, User
+from ..images import derivative_name, store_image
+from ..models import (Favorite, Ingredient, IngredientInRecipe, Job, Recipe,
+                      ShoppingCart, Tag)
 
 
 class ModelTest(TestCase):
@@ -50,3 +59,182 @@ class ModelTest(TestCase):
         """Проверяем, что объект модели имеет читаемое название."""
         for item in self.object_list:
             self.assertEqual(str(item), item.name)
+
+
+class IndexUsageTest(TestCase):
+    """Проверяем по плану запроса, что горячие выборки идут
+    по индексам, а не полным просмотром таблиц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create на SQLite не возвращает id, поэтому объекты
+        # перечитываются из базы.
+        User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@mail.ru',
+                 first_name='Имя', last_name='Фамилия')
+            for i in range(50)
+        )
+        users = list(User.objects.order_by('id'))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(100)
+        )
+        ingredients = list(Ingredient.objects.order_by('id'))
+        Recipe.objects.bulk_create(
+            Recipe(author=users[i % len(users)], name=f'Рецепт {i}',
+                   image='recipes/image.jpeg', text='Текст', cooking_time=5)
+            for i in range(1000)
+        )
+        recipes = list(Recipe.objects.order_by('id'))
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe,
+                               ingredient=ingredients[(i + j) % 100],
+                               amount=10)
+            for i, recipe in enumerate(recipes) for j in range(5)
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipes[(i * 7 + j) % 1000])
+            for i, user in enumerate(users) for j in range(20)
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipes[(i * 3 + j) % 1000])
+            for i, user in enumerate(users) for j in range(10)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=user, author=users[(i + j) % 50])
+            for i, user in enumerate(users) for j in range(1, 11)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = users[0]
+        cls.recipe = recipes[0]
+
+    def assert_uses_index(self, queryset, index=None):
+        """На SQLite таблица должна читаться поиском по индексу без
+        отдельной сортировки. На PostgreSQL дополнительно проверяется
+        имя индекса: на тестовом объеме данных планировщик может
+        предпочесть полный просмотр, поэтому он отключается."""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn('Sort', plan)
+            if index is not None:
+                self.assertIn(index, plan)
+        else:
+            plan = queryset.explain()
+            self.assertIn('USING', plan)
+            self.assertNotIn('SCAN', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_hot_lookups_use_indexes(self):
+        """Избранное и корзина по пользователю, подписки по подписчику,
+        рецепты автора по убыванию id и ингредиенты рецепта."""
+        self.assert_uses_index(
+            Favorite.objects.filter(user=self.user, recipe=self.recipe))
+        self.assert_uses_index(
+            ShoppingCart.objects.filter(user=self.user).values('recipe_id'))
+        self.assert_uses_index(
+            Subscription.objects.filter(
+                subscriber=self.user).values('author_id'),
+            'subscription_subscriber_idx')
+        self.assert_uses_index(
+            Recipe.objects.filter(author=self.user).order_by('-id'),
+            'recipe_author_id_idx')
+        self.assert_uses_index(
+            IngredientInRecipe.objects.filter(recipe=self.recipe))
+        self.assert_uses_index(
+            Recipe.objects.filter(image='recipes/image.png').values('pk'),
+            'recipe_image_idx')
+
+
+class ImageReleaseTest(TransactionTestCase):
+    """Файлы удаляются после фиксации транзакции, поэтому нужен
+    TransactionTestCase."""
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=self.media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.author = User.objects.create_user(
+            username='author', email='author@yandex.ru', password='pass')
+
+    def create_file(self, name):
+        path = os.path.join(self.media_root.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        return path
+
+    def test_image_deleted_with_last_recipe(self):
+        """Проверяем, что общая картинка и ее копии удаляются вместе
+        с последним ссылающимся на нее рецептом."""
+        image = self.create_file('recipes/shared.png')
+        thumbnail = self.create_file(
+            derivative_name('recipes/shared.png', 'thumbnail', 'webp'))
+        first, second = (
+            Recipe.objects.create(
+                author=self.author, name=name, image='recipes/shared.png',
+                text='Текст', cooking_time=5)
+            for name in ('Первый', 'Второй')
+        )
+
+        first.delete()
+        self.assertTrue(os.path.exists(image))
+        second.delete()
+        self.assertFalse(os.path.exists(image))
+        self.assertFalse(os.path.exists(thumbnail))
+
+    def test_image_release_keeps_same_stem_derivatives(self):
+        """Проверяем, что удаление старой картинки temp.png не трогает
+        копии картинки temp.jpeg другого рецепта."""
+        png, jpeg = (
+            Recipe.objects.create(
+                author=self.author, name=image, image=f'recipes/{image}',
+                text='Текст', cooking_time=5)
+            for image in ('temp.png', 'temp.jpeg')
+        )
+        for recipe in (png, jpeg):
+            self.create_file(recipe.image.name)
+        kept = self.create_file(
+            derivative_name(jpeg.image.name, 'feed', 'jpeg'))
+        released = self.create_file(
+            derivative_name(png.image.name, 'feed', 'jpeg'))
+
+        png.delete()
+        self.assertFalse(os.path.exists(released))
+        self.assertTrue(os.path.exists(kept))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.media_root.name, 'recipes', 'temp.jpeg')))
+
+    def test_image_kept_on_rollback(self):
+        image = self.create_file('recipes/kept.png')
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image='recipes/kept.png',
+            text='Текст', cooking_time=5)
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                recipe.delete()
+                raise ValueError
+        self.assertTrue(os.path.exists(image))
+
+    def test_image_restored_after_concurrent_release(self):
+        """Проверяем, что картинка, которую удалила параллельная
+        транзакция, пока новый рецепт с ней не зафиксирован, после
+        фиксации записывается снова."""
+        content = b'\x89PNG\r\n\x1a\nimage data'
+        name = store_image(ContentFile(content))
+        with transaction.atomic():
+            self.assertEqual(store_image(ContentFile(content)), name)
+            recipe = Recipe.objects.create(
+                author=self.author, name='Рецепт', image=name,
+                text='Текст', cooking_time=5, derivatives_source=name)
+            default_storage.delete(name)
+
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), content)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.derivatives_source, '')
+        self.assertTrue(Job.objects.filter(argument=str(recipe.pk)).exists())
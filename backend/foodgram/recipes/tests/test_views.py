@@ -1,16 +1,44 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
+from PIL import Image
+import base64
+import hashlib
+import io
 import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-from ..models import (Favorite, Ingredient,
+from ..images import derivative_name
+from ..models import (Favorite, Ingredient, IngredientInRecipe,
                       Recipe, ShoppingCart, Tag)
-from ..serializers import (IngredientSerializer,
+from ..serializers import (CreateRecipeSerializer, IngredientSerializer,
                            IngredientInRecipeSerializer,
                            TagSerializer)
 from users.models import User
 from users.serializers import UserSerializer
 
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1'
+         'PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC')
+
+
+def run_on_commit_callbacks():
+    """TestCase не фиксирует транзакцию, поэтому отложенные до фиксации
+    действия выполняем явно, как captureOnCommitCallbacks в Django 3.2."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
 
 class TagTest(APITestCase):
     @classmethod
@@ -29,6 +57,7 @@ class TagTest(APITestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
     def test_list_tags(self):
@@ -62,6 +91,34 @@ class TagTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn('detail', response.data)
 
+    def test_tags_cached_with_validators(self):
+        """Проверяем, что тэги отдаются из кеша с ETag и Last-Modified,
+        а изменение тэга сбрасывает кеш."""
+        url = reverse('recipes:tags-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            detail = self.client.get(
+                reverse('recipes:tags-detail',
+                        kwargs={'id': self.new_tag.id}))
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(detail.data['slug'], 'new')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.new_tag.name = 'Новое'
+        self.new_tag.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Новое', [tag['name'] for tag in response.data])
+
 
 class IngredientTest(APITestCase):
     @classmethod
@@ -79,6 +136,7 @@ class IngredientTest(APITestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
     def test_list_ingredients(self):
@@ -123,6 +181,53 @@ class IngredientTest(APITestCase):
                     len(all_ingredients.filter(name__startswith=i))
                 )
 
+    def test_search_ingredients_ranked_and_limited(self):
+        """Проверяем, что поиск ингредиентов не зависит от регистра,
+        сортирует результаты по названию и ограничивает их число."""
+        for name in ('сосиски молочные', 'сосиски баварские', 'соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        url = reverse('recipes:ingredients-list')
+
+        response = self.client.get(url, {'name': 'сос'})
+        self.assertEqual(
+            [item['name'] for item in response.data],
+            ['Сосиска', 'сосиски баварские', 'сосиски молочные']
+        )
+
+        with override_settings(INGREDIENT_SEARCH_LIMIT=2):
+            response = self.client.get(url, {'name': 'СО'})
+        self.assertEqual(
+            [item['name'] for item in response.data],
+            ['соль', 'Сосиска']
+        )
+
+        response = self.client.get(url, {'name': 'перец'})
+        self.assertEqual(response.data, [])
+
+    def test_ingredients_served_from_catalog(self):
+        """Проверяем, что повторные запросы к ингредиентам не обращаются
+        к базе, а изменение ингредиента сбрасывает каталог."""
+        list_url = reverse('recipes:ingredients-list')
+        detail_url = reverse(
+            'recipes:ingredients-detail', kwargs={'id': self.eggs.id})
+        self.client.get(list_url)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(list_url)
+            self.client.get(list_url, {'name': 'я'})
+            response = self.client.get(detail_url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.data['name'], 'Яйцо')
+
+        response = self.client.get(
+            reverse('recipes:ingredients-detail', kwargs={'id': 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.eggs.name = 'Яйца'
+        self.eggs.save()
+        response = self.client.get(detail_url)
+        self.assertEqual(response.data['name'], 'Яйца')
+
 
 class RecipeTest(APITestCase):
     @classmethod
@@ -210,11 +315,200 @@ class RecipeTest(APITestCase):
             through_defaults={'amount': 2}
         )
 
+    def create_recipes(self, count, author=None):
+        return [
+            Recipe.objects.create(
+                author=author or self.russian_president,
+                name=f'Рецепт {i}',
+                image='recipes/63fb3d69-37e1-4832-965d-fb282d1e8ba4.jpeg',
+                text='Текст',
+                cooking_time=5
+            )
+            for i in range(count)
+        ]
+
     def test_list_recipes(self):
         response = self.client.get(reverse('recipes:recipes-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['count'], 2)
 
+    def collect_pages(self, url):
+        ids, links = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['count'], Recipe.objects.count())
+            ids += [recipe['id'] for recipe in response.data['results']]
+            links.append(response.data['next'])
+            url = response.data['next']
+        return ids, links
+
+    def test_list_recipes_keyset_pagination(self):
+        """Проверяем, что keyset-пагинация отдает те же страницы,
+        что и постраничная, в обе стороны."""
+        self.create_recipes(5)
+        url = reverse('recipes:recipes-list') + '?limit=3'
+        expected = list(Recipe.objects.values_list('id', flat=True))
+
+        ids, links = self.collect_pages(url)
+        self.assertEqual(ids, expected)
+        self.assertNotIn('after=', links[0])
+
+        with override_settings(RECIPES_KEYSET_PAGINATION=True):
+            ids, links = self.collect_pages(url)
+            self.assertEqual(ids, expected)
+            self.assertIn('page=2', links[0])
+            self.assertIn(f'after={expected[2]}', links[0])
+
+            response = self.client.get(
+                f'{url}&page=3&after={expected[5]}')
+            previous = self.client.get(response.data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in previous.data['results']],
+            expected[3:6]
+        )
+        self.assertIn(f'before={expected[6]}', response.data['previous'])
+
+    def test_list_recipes_cursor_edges(self):
+        """Проверяем курсор без номера страницы и курсор, за которым
+        рецептов нет."""
+        self.create_recipes(5)
+        url = reverse('recipes:recipes-list')
+        expected = list(Recipe.objects.values_list('id', flat=True))
+
+        response = self.client.get(url, {'limit': 3, 'after': expected[3]})
+        self.assertEqual(response.data['count'], len(expected))
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            expected[4:7])
+        self.assertIsNone(response.data['next'])
+
+        for before in (expected[0], 999999):
+            with self.subTest(before=before):
+                response = self.client.get(
+                    url, {'limit': 3, 'page': 2, 'before': before})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.data['results'], [])
+                self.assertIsNone(response.data['next'])
+
+        response = self.client.get(url, {'limit': 3, 'before': expected[4]})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            expected[1:4])
+        self.assertIn(f'after={expected[3]}', response.data['next'])
+
+    def test_list_recipes_last_page_skips_count(self):
+        """Проверяем, что на последней странице не выполняется
+        отдельный COUNT(*)."""
+        self.create_recipes(2)
+        url = reverse('recipes:recipes-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'limit': 3, 'page': 2})
+        self.assertEqual(response.data['count'], 4)
+        self.assertFalse(
+            [query for query in queries if 'COUNT(' in query['sql']])
+
+        response = self.client.get(url, {'page': 5})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_recipes_user_flags(self):
+        """Проверяем, что флаги is_favorited и is_in_shopping_cart
+        вычисляются для текущего пользователя."""
+        Favorite.objects.create(
+            user=self.russian_president, recipe=self.recipe2)
+        ShoppingCart.objects.create(
+            user=self.russian_president, recipe=self.recipe1)
+
+        response = self.authenticated_client.get(
+            reverse('recipes:recipes-list'))
+        flags = {
+            recipe['id']: (recipe['is_favorited'],
+                           recipe['is_in_shopping_cart'])
+            for recipe in response.data['results']
+        }
+        self.assertEqual(flags[self.recipe1.id], (False, True))
+        self.assertEqual(flags[self.recipe2.id], (True, False))
+
+        response = self.authenticated_client2.get(
+            reverse('recipes:recipes-list'))
+        for recipe in response.data['results']:
+            with self.subTest(recipe=recipe['id']):
+                self.assertFalse(recipe['is_favorited'])
+                self.assertFalse(recipe['is_in_shopping_cart'])
+
+    def test_list_recipes_flags_query_count(self):
+        """Проверяем, что флаги не порождают запрос на каждый рецепт."""
+        for recipe in self.create_recipes(3):
+            Favorite.objects.create(
+                user=self.russian_president, recipe=recipe)
+
+        with CaptureQueriesContext(connection) as context:
+            self.authenticated_client.get(reverse('recipes:recipes-list'))
+        flag_queries = [
+            query for query in context.captured_queries
+            if 'recipes_favorite' in query['sql']
+            and 'recipes_recipe' not in query['sql']
+        ]
+        self.assertEqual(flag_queries, [])
+
+    def test_list_recipes_related_query_count(self):
+        """Проверяем, что тэги и ингредиенты рецептов подгружаются
+        одним запросом на всю страницу."""
+        for recipe in self.create_recipes(3, self.american_president):
+            recipe.tags.add(self.breakfast_tag)
+            recipe.ingredients.add(self.egg, through_defaults={'amount': 1})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('recipes:recipes-list'))
+        self.assertEqual(response.data['count'], 5)
+
+        for table, expected in (('recipes_tag', 1),
+                                ('recipes_ingredientinrecipe', 1),
+                                ('recipes_ingredient', 0),
+                                ('users_subscription', 0)):
+            with self.subTest(table=table):
+                queries = [
+                    query for query in context.captured_queries
+                    if f'FROM "{table}" ' in query['sql']
+                ]
+                self.assertEqual(len(queries), expected)
+
+    def test_list_recipes_sparse_fieldset(self):
+        """Проверяем, что ?fields= оставляет только запрошенные поля
+        и не подгружает незапрошенные связи, а ?expand= раскрывает
+        связи, которые иначе выводятся идентификаторами."""
+        url = reverse('recipes:recipes-list')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                url, {'fields': 'id,name,image,cooking_time'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(response.data['results'][0]),
+            ['id', 'name', 'image', 'cooking_time'])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('"text"', context.captured_queries[0]['sql'])
+
+        response = self.client.get(
+            url, {'fields': 'id,author,tags,ingredients'})
+        recipe = response.data['results'][-1]
+        self.assertEqual(recipe['author'], self.russian_president.id)
+        self.assertEqual(
+            sorted(recipe['tags']), [self.breakfast_tag.id, self.new_tag.id])
+        self.assertEqual(
+            recipe['ingredients'], [{'id': self.dumplings.id, 'amount': 300}])
+
+        response = self.client.get(
+            url, {'fields': 'id', 'expand': 'author'})
+        recipe = response.data['results'][-1]
+        self.assertEqual(list(recipe), ['id', 'author'])
+        self.assertEqual(recipe['author']['username'], 'v.putin')
+
+        for params in ({'fields': 'id,secret'}, {'expand': 'name'}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_list_filter_author_recipes(self):
         urls = {
             'http://127.0.0.1:8000/api/recipes/?author=1': 1,
@@ -228,6 +522,36 @@ class RecipeTest(APITestCase):
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(response.data['count'], cnt)
 
+    def test_list_filter_tags_and_flags_without_duplicates(self):
+        """Проверяем, что рецепт с несколькими выбранными тэгами или
+        отметками попадает в выдачу один раз."""
+        self.recipe2.tags.add(self.new_tag)
+        Favorite.objects.create(
+            user=self.russian_president, recipe=self.recipe1)
+        ShoppingCart.objects.create(
+            user=self.russian_president, recipe=self.recipe1)
+        url = reverse('recipes:recipes-list')
+
+        response = self.client.get(url, {'tags': ['breakfast', 'new']})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            sorted(recipe['id'] for recipe in response.data['results']),
+            [self.recipe1.id, self.recipe2.id]
+        )
+
+        response = self.authenticated_client.get(url, {
+            'tags': ['breakfast', 'new'],
+            'is_favorited': 1,
+            'is_in_shopping_cart': 1,
+        })
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.recipe1.id]
+        )
+
+        response = self.client.get(url, {'is_favorited': 1})
+        self.assertEqual(response.data['count'], 0)
+
     def test_retrieve_status_code_recipes(self):
         response = self.client.get(
             reverse('recipes:recipes-detail',
@@ -281,6 +605,7 @@ class RecipeTest(APITestCase):
                                  ing_serializer.data)
 
 
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class CreateRecipeTest(APITestCase):
     @classmethod
     def setUpClass(cls):
@@ -392,6 +717,11 @@ class CreateRecipeTest(APITestCase):
             cooking_time=10
         )
 
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
     def test_create_recipe(self):
         """Проверяем возможность API создавать объекты."""
         response = self.authenticated_client.post(
@@ -478,6 +808,234 @@ class CreateRecipeTest(APITestCase):
         self.assertEqual(len(response.data['ingredients']),
                          len(self.update_payload3['ingredients']))
 
+    def test_create_recipe_bulk_ingredients(self):
+        """Проверяем, что ингредиенты рецепта сохраняются
+        одним запросом."""
+        payload = dict(self.doshirak_payload, image=IMAGE)
+        with CaptureQueriesContext(connection) as context:
+            response = self.authenticated_client.post(
+                reverse('recipes:recipes-list'),
+                data=json.dumps(payload),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['ingredients']), 2)
+
+        inserts = [
+            query for query in context.captured_queries
+            if query['sql'].startswith(
+                'INSERT INTO "recipes_ingredientinrecipe"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+    def post_recipe_image(self, image):
+        return self.authenticated_client.post(
+            reverse('recipes:recipes-list'),
+            data=json.dumps(dict(self.doshirak_payload, image=image)),
+            content_type='application/json'
+        )
+
+    def test_create_recipe_image_sniffed_format(self):
+        """Проверяем, что формат картинки определяется по содержимому,
+        а имя файла не повторяется."""
+        image = IMAGE.replace('image/png', 'image/jpeg')
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10):
+            response = self.post_recipe_image(image)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertTrue(recipe.image.name.endswith('.png'))
+        self.assertNotIn('temp', recipe.image.name)
+        self.assertEqual(recipe.image.read(), base64.b64decode(
+            IMAGE.split(',')[1]))
+
+    def test_create_recipe_image_derivatives(self):
+        """Проверяем, что уменьшенные копии картинки создаются
+        фоновой задачей, а до этого ссылки ведут на оригинал."""
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 800), '#ffce26').save(buffer, 'png')
+        image = ('data:image/png;base64,'
+                 + base64.b64encode(buffer.getvalue()).decode())
+        response = self.post_recipe_image(image)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['images_status'], 'processing')
+        self.assertEqual(response.data['images']['feed'],
+                         response.data['image'])
+
+        call_command('run_jobs', once=True, concurrency=1,
+                     stdout=io.StringIO())
+        url = reverse('recipes:recipes-detail',
+                      kwargs={'id': response.data['id']})
+        response = self.authenticated_client.get(url)
+        self.assertEqual(response.data['images_status'], 'ready')
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        images = response.data['images']
+        self.assertTrue(images['thumbnail_webp'].endswith('-thumbnail.webp'))
+        self.assertTrue(images['feed'].endswith('-feed.jpg'))
+        for rendition, size in (('thumbnail', 200), ('feed', 600)):
+            for extension in ('jpg', 'webp'):
+                name = derivative_name(
+                    recipe.image.name, rendition,
+                    'jpeg' if extension == 'jpg' else extension)
+                with recipe.image.storage.open(name) as file:
+                    self.assertEqual(max(Image.open(file).size), size)
+
+    def test_same_image_stored_once(self):
+        """Проверяем, что одинаковые картинки хранятся одним файлом,
+        а обновление с той же картинкой ничего не записывает."""
+        first = self.post_recipe_image(IMAGE)
+        second = self.authenticated_client.post(
+            reverse('recipes:recipes-list'),
+            data=json.dumps(dict(
+                self.doshirak_payload, name='Доширак-2', image=IMAGE)),
+            content_type='application/json'
+        )
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data['image'], second.data['image'])
+        digest = hashlib.sha256(
+            base64.b64decode(IMAGE.split(',')[1])).hexdigest()
+        self.assertTrue(first.data['image'].endswith(f'{digest}.png'))
+
+        url = reverse('recipes:recipes-detail',
+                      kwargs={'id': first.data['id']})
+        with mock.patch.object(default_storage, 'save') as save:
+            response = self.authenticated_client.patch(
+                url,
+                data=json.dumps({'image': IMAGE, 'cooking_time': 3}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        save.assert_not_called()
+
+    def test_update_recipe_keeps_worker_derivatives(self):
+        """Проверяем, что изменение рецепта не затирает отметку
+        о готовых копиях, которую воркер поставил после загрузки
+        рецепта."""
+        recipe = Recipe.objects.get(
+            pk=self.post_recipe_image(IMAGE).data['id'])
+        self.assertEqual(recipe.derivatives_source, '')
+        Recipe.objects.filter(pk=recipe.pk).update(
+            derivatives_source=recipe.image.name)
+
+        serializer = CreateRecipeSerializer(
+            recipe, data={'name': 'Новое название'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.derivatives_source, recipe.image.name)
+
+    def test_multipart_images_named_by_content(self):
+        """Проверяем, что разные картинки, загруженные с одинаковым
+        именем файла, не заменяют друг друга."""
+        recipe = Recipe.objects.get(
+            pk=self.post_recipe_image(IMAGE).data['id'])
+        url = reverse('recipes:recipes-detail', kwargs={'id': recipe.id})
+        names = []
+        for color in ('red', 'blue'):
+            upload = io.BytesIO()
+            Image.new('RGB', (4, 4), color).save(upload, 'PNG')
+            upload.name = 'photo.png'
+            upload.seek(0)
+            response = self.authenticated_client.patch(
+                url, data={'image': upload}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            recipe.refresh_from_db()
+            names.append(recipe.image.name)
+            with recipe.image.open() as file:
+                self.assertEqual(file.read(), upload.getvalue())
+        self.assertNotEqual(names[0], names[1])
+        self.assertNotIn('photo', names[0])
+
+    def test_create_recipe_invalid_image(self):
+        """Проверяем, что слишком большие, битые и неизвестные
+        картинки отклоняются."""
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=10):
+            response = self.post_recipe_image(IMAGE)
+        self.assertIn('image', response.data)
+
+        for image in ('data:image/png;base64,iVBOR!==',
+                      'data:image/png;base64,' + base64.b64encode(
+                          b'<svg></svg>').decode()):
+            with self.subTest(image=image):
+                response = self.post_recipe_image(image)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('image', response.data)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_create_recipe_unknown_ingredient(self):
+        """Проверяем, что рецепт с несуществующим ингредиентом
+        не создается."""
+        payload = dict(
+            self.doshirak_payload,
+            image=IMAGE,
+            ingredients=[{'id': 1, 'amount': 1}, {'id': 100, 'amount': 1}]
+        )
+        response = self.authenticated_client.post(
+            reverse('recipes:recipes-list'),
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ingredients', response.data)
+        self.assertEqual(len(Recipe.objects.all()), 1)
+
+    def test_update_recipe_writes_only_changes(self):
+        """Проверяем, что при обновлении рецепта меняются только
+        действительно изменившиеся ингредиенты и тэги."""
+        url = reverse('recipes:recipes-detail', kwargs={'id': 1})
+        self.authenticated_client.patch(
+            url,
+            data=json.dumps(self.update_payload2),
+            content_type='application/json'
+        )
+        ingredient_rows = set(
+            self.recipe2.ingredients_in.values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.authenticated_client.patch(
+                url,
+                data=json.dumps({'name': 'Новое название'}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['ingredients']), 2)
+        self.assertEqual(len(response.data['tags']), 2)
+        writes = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE "recipes_recipe"'))
+
+        payload = dict(
+            self.update_payload2,
+            tags=[1],
+            ingredients=[{'id': 1, 'amount': 10}, {'id': 2, 'amount': 250}]
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.authenticated_client.patch(
+                url,
+                data=json.dumps(payload),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['tags']), 1)
+        self.assertEqual(
+            {item['id']: item['amount']
+             for item in response.data['ingredients']},
+            {1: 10, 2: 250}
+        )
+        self.assertEqual(
+            set(self.recipe2.ingredients_in.values_list('id', flat=True)),
+            ingredient_rows
+        )
+        self.assertFalse(any(
+            query['sql'].startswith('DELETE FROM "recipes_ingredientinrecipe"')
+            for query in context.captured_queries
+        ))
+
     def test_update_unauthorized_recipe(self):
         response = self.client.patch(
             reverse('recipes:recipes-detail', kwargs={'id': 1}),
@@ -502,6 +1060,15 @@ class CreateRecipeTest(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_put_recipe_not_allowed(self):
+        response = self.authenticated_client2.put(
+            reverse('recipes:recipes-detail', kwargs={'id': 1}),
+            data=json.dumps(self.update_payload3),
+            content_type='application/json'
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
 
 class FavoriteRecipeTest(APITestCase):
     @classmethod
@@ -566,6 +1133,33 @@ class FavoriteRecipeTest(APITestCase):
             with self.subTest(field=field):
                 self.assertIn(field, response.data.keys())
 
+    def test_favorites_count(self):
+        """Проверяем, что счетчик избранного у рецепта меняется
+        при добавлении и удалении рецепта из избранного."""
+        url = reverse('recipes:recipes-favorite', kwargs={'id': 1})
+        self.authenticated_client.post(url)
+        self.authenticated_client2.post(url)
+        self.test_recipe.refresh_from_db()
+        self.assertEqual(self.test_recipe.favorites_count, 2)
+
+        self.authenticated_client.delete(url)
+        self.test_recipe.refresh_from_db()
+        self.assertEqual(self.test_recipe.favorites_count, 1)
+
+    def test_update_recipe_keeps_favorites_count(self):
+        """Проверяем, что изменение рецепта не затирает счетчик
+        избранного, увеличенный после загрузки рецепта."""
+        recipe = Recipe.objects.get(pk=self.test_recipe.pk)
+        Favorite.objects.create(user=self.test_user2, recipe=recipe)
+        serializer = CreateRecipeSerializer(
+            recipe, data={'name': 'new name'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'new name')
+        self.assertEqual(recipe.favorites_count, 1)
+
     def test_create_duplicate_favorite(self):
         """Проверяем возможность API несколько раз добавлять
         один и тот же рецепт в избранное."""
@@ -659,6 +1253,7 @@ class ShoppingCartTest(APITestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.shopping_cart = ShoppingCart.objects.create(
             user=self.test_user,
             recipe=self.test_recipe
@@ -672,6 +1267,168 @@ class ShoppingCartTest(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_download_shopping_cart_sums_ingredients(self):
+        """Проверяем, что одинаковые ингредиенты разных рецептов
+        суммируются в списке покупок."""
+        egg = Ingredient.objects.create(name='Яйцо', measurement_unit='шт')
+        milk = Ingredient.objects.create(name='Молоко', measurement_unit='мл')
+        omelette = Recipe.objects.create(
+            author=self.test_user2,
+            name='Омлет',
+            image='recipes/63fb3d69-37e1-4832-965d-fb282d1e8ba4.jpeg',
+            text='test text',
+            cooking_time=5
+        )
+        omelette.ingredients.add(egg, through_defaults={'amount': 3})
+        omelette.ingredients.add(milk, through_defaults={'amount': 100})
+        self.test_recipe.ingredients.add(egg, through_defaults={'amount': 2})
+        ShoppingCart.objects.create(user=self.test_user, recipe=omelette)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.authenticated_client.get(
+                reverse('recipes:recipes-download-shopping-cart')
+            )
+        content = response.content.decode()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(
+            content,
+            '* Молоко (мл) - 100\n* Яйцо (шт) - 5\n'
+        )
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_download_shopping_cart_formats(self):
+        """Проверяем возможность API отдавать список покупок
+        в формате, выбранном через ?format= или заголовок Accept."""
+        egg = Ingredient.objects.create(name='Яйцо', measurement_unit='шт')
+        self.test_recipe.ingredients.add(egg, through_defaults={'amount': 2})
+        url = reverse('recipes:recipes-download-shopping-cart')
+
+        response = self.authenticated_client.get(url, {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            response.content.decode().splitlines(),
+            ['name,measurement_unit,amount', 'Яйцо,шт,2']
+        )
+
+        response = self.authenticated_client.get(
+            url, HTTP_ACCEPT='application/json')
+        self.assertEqual(
+            json.loads(response.content),
+            [{'name': 'Яйцо', 'measurement_unit': 'шт', 'amount': 2}]
+        )
+
+        with override_settings(SHOPPING_CART_PDF_FONT=None):
+            response = self.authenticated_client.get(url, {'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF-'))
+        self.assertTrue(response.content.rstrip().endswith(b'%%EOF'))
+
+        response = self.authenticated_client.get(url, {'format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_download_shopping_cart_pdf_font_subset(self):
+        """Проверяем, что в PDF встраиваются только нужные глифы
+        шрифта, а не весь файл шрифта."""
+        font = settings.SHOPPING_CART_PDF_FONT
+        if not font or not os.path.exists(font):
+            self.skipTest('Шрифт для PDF не установлен')
+        url = reverse('recipes:recipes-download-shopping-cart')
+        response = self.authenticated_client.get(url, {'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn(b'/FontFile2', response.content)
+        self.assertRegex(response.content, rb'/BaseFont /[A-Z]{6}\+')
+        self.assertLess(len(response.content), os.path.getsize(font) // 10)
+
+    def test_download_shopping_cart_not_modified(self):
+        """Проверяем, что повторное скачивание неизменного списка
+        покупок возвращает 304, а изменение списка сбрасывает ETag."""
+        url = reverse('recipes:recipes-download-shopping-cart')
+        response = self.authenticated_client.get(url)
+        etag = response['ETag']
+
+        response = self.authenticated_client.get(
+            url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.authenticated_client.delete(
+            reverse('recipes:recipes-shopping-cart',
+                    kwargs={'id': self.test_recipe.id})
+        )
+        run_on_commit_callbacks()
+        response = self.authenticated_client.get(
+            url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_download_shopping_cart_after_recipe_update(self):
+        """Проверяем, что изменение рецепта из корзины обновляет
+        закэшированный список покупок."""
+        url = reverse('recipes:recipes-download-shopping-cart')
+        egg = Ingredient.objects.create(name='Яйцо', measurement_unit='шт')
+        self.test_recipe.ingredients.add(egg, through_defaults={'amount': 2})
+        response = self.authenticated_client.get(url)
+        self.assertEqual(response.content.decode(), '* Яйцо (шт) - 2\n')
+
+        self.authenticated_client.patch(
+            reverse('recipes:recipes-detail',
+                    kwargs={'id': self.test_recipe.id}),
+            data=json.dumps({
+                'tags': [],
+                'ingredients': [{'id': egg.id, 'amount': 4}],
+                'name': self.test_recipe.name,
+                'text': self.test_recipe.text,
+                'cooking_time': 5
+            }),
+            content_type='application/json'
+        )
+        run_on_commit_callbacks()
+        response = self.authenticated_client.get(url)
+        self.assertEqual(response.content.decode(), '* Яйцо (шт) - 4\n')
+
+    def test_download_shopping_cart_after_direct_edits(self):
+        """Проверяем, что правки в обход API (например, в админке)
+        тоже сбрасывают список покупок, но только после фиксации."""
+        url = reverse('recipes:recipes-download-shopping-cart')
+        self.shopping_cart.delete()
+        recipe = Recipe.objects.create(
+            author=self.test_user2,
+            name='Яичница',
+            image='recipes/63fb3d69-37e1-4832-965d-fb282d1e8ba4.jpeg',
+            text='test text',
+            cooking_time=5
+        )
+        ShoppingCart.objects.create(user=self.test_user, recipe=recipe)
+        egg = Ingredient.objects.create(name='Яйцо', measurement_unit='шт')
+        row = IngredientInRecipe.objects.create(
+            recipe=recipe, ingredient=egg, amount=2)
+        run_on_commit_callbacks()
+        self.assertEqual(
+            self.authenticated_client.get(url).content.decode(),
+            '* Яйцо (шт) - 2\n')
+
+        row.amount = 3
+        row.save()
+        self.assertEqual(
+            self.authenticated_client.get(url).content.decode(),
+            '* Яйцо (шт) - 2\n')
+        run_on_commit_callbacks()
+        self.assertEqual(
+            self.authenticated_client.get(url).content.decode(),
+            '* Яйцо (шт) - 3\n')
+
+        egg.name = 'Яйцо куриное'
+        egg.save()
+        run_on_commit_callbacks()
+        self.assertEqual(
+            self.authenticated_client.get(url).content.decode(),
+            '* Яйцо куриное (шт) - 3\n')
+
+        recipe.delete()
+        run_on_commit_callbacks()
+        self.assertEqual(
+            self.authenticated_client.get(url).content.decode(), '')
+
     def test_unauthorized_download_shopping_cart(self):
         """Проверяем возможность API отказывать неавторизованным
         пользователям скачивать список покупок."""
@@ -1,4 +1,6 @@
+from django.db import transaction
 from django.db.utils import IntegrityError
+from django.http import Http404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import serializers, status
 from rest_framework.decorators import action
@@ -6,20 +8,26 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .filters import CustomSearchFilter, RecipeFilter
+from .catalog import get_ingredient_catalog
+from .fieldsets import SparseFieldsetViewMixin
+from .filters import IngredientSearchFilter, RecipeFilter
 from .models import (Favorite,
                      Ingredient,
                      ShoppingCart,
                      Recipe,
                      Tag)
+from .pagination import RecipePagination
 from .permissions import IsAuthor
+from .renderers import SHOPPING_CART_RENDERERS
+from .tag_cache import tags_response
 from .serializers import (FavoriteSerializer,
                           IngredientSerializer,
                           CreateRecipeSerializer,
                           RecipeSerializer,
                           RecipeForFavoriteSerializer,
                           TagSerializer)
-from .download_shopping_cart import download_shopping_cart
+from .download_shopping_cart import (download_shopping_cart,
+                                     invalidate_shopping_carts_on_commit)
 
 
 def get_object_or_400(klass, text_error, *args, **kwargs):
@@ -38,6 +46,18 @@ class TagViewSet(ReadOnlyModelViewSet):
     pagination_class = None
     lookup_field = 'id'
 
+    def list(self, request, *args, **kwargs):
+        return tags_response(request, self, Response)
+
+    def retrieve(self, request, *args, **kwargs):
+        def build(tags):
+            for tag in tags:
+                if str(tag['id']) == str(self.kwargs[self.lookup_field]):
+                    return Response(tag)
+            raise Http404
+
+        return tags_response(request, self, build)
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     """Viewset для вывод одного или сразу всех ингредиентов."""
@@ -46,16 +66,37 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
     lookup_field = 'id'
-    filter_backends = (CustomSearchFilter,)
-    search_fields = ('^name',)
+    filter_backends = (IngredientSearchFilter,)
+
+    def get_queryset(self):
+        return get_ingredient_catalog().all()
 
+    def get_object(self):
+        ingredient = get_ingredient_catalog().get(
+            self.kwargs[self.lookup_field])
+        if ingredient is None:
+            raise Http404
+        self.check_object_permissions(self.request, ingredient)
+        return ingredient
 
-class RecipeViewSet(ModelViewSet):
-    """ViewSet для обработки запросов, связанных с рецептами."""
+
+class RecipeViewSet(SparseFieldsetViewMixin, ModelViewSet):
+    """ViewSet для обработки запросов, связанных с рецептами.
+    Список и рецепт поддерживают ?fields= и ?expand=."""
     queryset = Recipe.objects.all()
     lookup_field = 'id'
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
+    # Рецепт изменяется только через PATCH, PUT в API нет.
+    http_method_names = ('get', 'post', 'patch', 'delete', 'head', 'options')
+
+    def get_queryset(self):
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            return Recipe.objects.with_fieldset(fieldset, self.request.user)
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user)
 
     def get_permissions(self):
         if self.action in ('list', 'retrieve'):
@@ -82,7 +123,15 @@ class RecipeViewSet(ModelViewSet):
         context.update({'request': self.request})
         return context
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # Ингредиенты обновляются bulk-операциями без сигналов,
+        # удаление рецепта и корзины сбрасывают списки сами.
+        invalidate_shopping_carts_on_commit(
+            recipe_ids=[serializer.instance.id])
+
     @action(methods=['post', 'delete'], detail=True)
+    @transaction.atomic
     def favorite(self, request, id=None):
         recipe = get_object_or_400(
             Recipe,
@@ -111,7 +160,8 @@ class RecipeViewSet(ModelViewSet):
             favorite.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(methods=['get'], detail=False)
+    @action(methods=['get'], detail=False,
+            renderer_classes=SHOPPING_CART_RENDERERS)
     def download_shopping_cart(self, request):
         return download_shopping_cart(request)
 
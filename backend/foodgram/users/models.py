@@ -26,6 +26,16 @@ class User(AbstractUser):
     role = models.TextField(choices=ROLE_CHOICES,
                             default=USER,
                             verbose_name='Роль пользователя')
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
 
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name']
 
@@ -69,6 +79,14 @@ class Subscription(models.Model):
                 name='unique_subscriptions',
             ),
         )
+        indexes = (
+            # Уникальный индекс начинается с автора, а список подписок
+            # и is_subscribed ищут по подписчику.
+            models.Index(
+                fields=('subscriber', 'author'),
+                name='subscription_subscriber_idx',
+            ),
+        )
 
     def __str__(self):
         return f'{self.author} - {self.subscriber}'
@@ -2,11 +2,32 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
+from recipes.fieldsets import SparseFieldsetSerializerMixin
+from recipes.images import get_image_urls
 from recipes.models import Recipe
 from .models import Subscription, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_subscribed_authors(context):
+    """Возвращает множество id авторов, на которых подписан текущий
+    пользователь. Множество загружается один раз и хранится в контексте,
+    общем для всех вложенных сериализаторов."""
+    if 'subscribed_authors' not in context:
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+        if user is None or user.is_anonymous:
+            context['subscribed_authors'] = frozenset()
+        else:
+            context['subscribed_authors'] = frozenset(
+                Subscription.objects.filter(
+                    subscriber=user
+                ).values_list('author_id', flat=True)
+            )
+    return context['subscribed_authors']
+
+
+class UserSerializer(SparseFieldsetSerializerMixin,
+                     serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -15,15 +36,9 @@ class UserSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, instance):
-        try:
-            subscriber = self.context.get('request').user
-        except AttributeError:
-            return False
-        subscription_instance = Subscription.objects.filter(
-            author=instance.id, subscriber=subscriber.id)
-        if subscription_instance.exists():
-            return True
-        return False
+        if hasattr(instance, 'is_subscribed'):
+            return instance.is_subscribed
+        return instance.id in get_subscribed_authors(self.context)
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -63,14 +78,21 @@ class SubscriptionSerializer(serializers.ModelSerializer):
 
 
 class RecipeForSubscriptionSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
+
+    def get_images(self, instance):
+        return get_image_urls(instance, self.context.get('request'))
 
 
 class UserForSubscriptionSerializer(UserSerializer):
+    expandable_fields = ('recipes',)
+
     recipes = RecipeForSubscriptionSerializer(many=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -78,6 +100,5 @@ class UserForSubscriptionSerializer(UserSerializer):
                   'last_name', 'is_subscribed', 'recipes',
                   'recipes_count')
 
-    def get_recipes_count(self, instance):
-        author = User.objects.get(username=instance.username)
-        return len(Recipe.objects.filter(author=author))
+    def get_collapsed_field(self, name):
+        return serializers.PrimaryKeyRelatedField(many=True, read_only=True)
@@ -1,3 +1,5 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 import json
 from rest_framework import status
@@ -49,6 +51,26 @@ class GetUsers(APITestCase):
         self.assertEqual(response.data.get('results'), serializer.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_users_is_subscribed(self):
+        """Проверяем, что подписки текущего пользователя загружаются
+        одним запросом на весь список пользователей."""
+        Subscription.objects.create(
+            author=self.weasley, subscriber=self.potter)
+        with CaptureQueriesContext(connection) as context:
+            response = self.authorized_client.get(reverse('users:users-list'))
+        flags = {item['id']: item['is_subscribed']
+                 for item in response.data['results']}
+        self.assertEqual(flags, {
+            self.potter.id: False,
+            self.weasley.id: True,
+            self.granger.id: False,
+        })
+        queries = [
+            query for query in context.captured_queries
+            if 'FROM "users_subscription"' in query['sql']
+        ]
+        self.assertEqual(len(queries), 1)
+
     def test_get_success_single_user(self):
         """Проверяем способность API возвращать конкретного
         пользователей авторизованному пользователю."""
@@ -173,6 +195,21 @@ class ChangePasswordUserTest(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_change_password_keeps_counters(self):
+        """Проверяем, что смена пароля не затирает счетчики, которые
+        изменились после загрузки пользователя."""
+        user = User.objects.get(pk=self.user.pk)
+        client = APIClient()
+        client.force_authenticate(user)
+        Recipe.objects.create(
+            author=user, name='Рецепт', image='recipes/image.jpeg',
+            text='Текст', cooking_time=5)
+        client.post(reverse('users:users-set-password'), self.valid_payload)
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.recipes_count, 1)
+        self.assertTrue(user.check_password('test_password2'))
+
     def test_change_password_invalid_user(self):
         """Проверяем способность API реагировать верным образом на
         некорректные входные данные при попытке сменить пароль
@@ -347,6 +384,27 @@ class SubscriptionTest(APITestCase):
             with self.subTest(field=field):
                 self.assertIn(field, response.data.keys())
 
+    def test_subscription_counters(self):
+        """Проверяем, что счетчики подписчиков и рецептов автора
+        читаются из денормализованных полей и поддерживаются
+        в актуальном состоянии."""
+        self.test_user3.refresh_from_db()
+        self.assertEqual(self.test_user3.subscribers_count, 1)
+        self.assertEqual(self.test_user3.recipes_count, 2)
+
+        response = self.authorized_user2.post(
+            reverse('users:users-subscribe', kwargs={'id': 3})
+        )
+        self.assertEqual(response.data['recipes_count'], 2)
+        self.test_user3.refresh_from_db()
+        self.assertEqual(self.test_user3.subscribers_count, 2)
+
+        self.authorized_user.delete(
+            reverse('users:users-subscribe', kwargs={'id': 3})
+        )
+        self.test_user3.refresh_from_db()
+        self.assertEqual(self.test_user3.subscribers_count, 1)
+
     def test_create_self_subscription(self):
         """Проверяем возможность API выдавать правильный ответ на
         запрос создания подписки на самого себя."""
@@ -430,6 +488,35 @@ class SubscriptionTest(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_subscriptions_recipes_limit(self):
+        """Проверяем, что параметр recipes_limit ограничивает число
+        рецептов автора, а количество запросов не зависит от числа
+        подписок."""
+        url = reverse('users:users-subscriptions')
+        with CaptureQueriesContext(connection) as context:
+            response = self.authorized_user.get(url, {'recipes_limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+
+        author = next(item for item in response.data['results']
+                      if item['id'] == self.test_user3.id)
+        self.assertEqual(len(author['recipes']), 1)
+        self.assertEqual(author['recipes'][0]['id'], self.test_recipe2.id)
+        self.assertEqual(author['recipes_count'], 2)
+        for item in response.data['results']:
+            with self.subTest(author=item['id']):
+                self.assertTrue(item['is_subscribed'])
+
+        Subscription.objects.create(
+            author=self.test_user, subscriber=self.test_user2)
+        Subscription.objects.create(
+            author=self.test_user3, subscriber=self.test_user2)
+        with CaptureQueriesContext(connection) as context2:
+            response = self.authorized_user2.get(url)
+        self.assertEqual(len(response.data['results'][1]['recipes']), 2)
+        self.assertEqual(
+            len(context.captured_queries), len(context2.captured_queries))
+
     def test_list_unauthorized_subscription(self):
         """Проверяем возможность API отказывать в доступе неавторизованному
         пользователю на запрос вывода всех подписок пользователя."""
@@ -437,3 +524,24 @@ class SubscriptionTest(APITestCase):
             reverse('users:users-subscriptions')
         )
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_list_subscriptions_sparse_fieldset(self):
+        """Проверяем, что подписки без рецептов в ?fields= выводятся
+        без их загрузки, а нераскрытые рецепты — идентификаторами."""
+        url = reverse('users:users-subscriptions')
+        with CaptureQueriesContext(connection) as context:
+            response = self.authorized_user.get(
+                url, {'fields': 'id,username'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(response.data['results'][0]), ['id', 'username'])
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'FROM "recipes_recipe"' in query['sql']
+        ])
+
+        response = self.authorized_user.get(
+            url, {'fields': 'id,recipes', 'recipes_limit': 1})
+        author = next(item for item in response.data['results']
+                      if item['id'] == self.test_user3.id)
+        self.assertEqual(author['recipes'], [self.test_recipe2.id])
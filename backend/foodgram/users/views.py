@@ -1,3 +1,6 @@
+from django.db import transaction
+from django.db.models import (BooleanField, OuterRef, Prefetch,
+                              Subquery, Value, prefetch_related_objects)
 from django.shortcuts import get_object_or_404
 from djoser import utils
 from djoser.serializers import (SetPasswordSerializer,
@@ -10,6 +13,8 @@ from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes.fieldsets import SparseFieldsetViewMixin
+from recipes.models import Recipe
 from recipes.permissions import IsAuthor
 from recipes.views import get_object_or_400
 from .models import Subscription, User
@@ -21,12 +26,41 @@ from .serializers import (
 )
 
 
-class UserViewSet(mixins.RetrieveModelMixin,
+def get_recipes_limit(request):
+    """Возвращает значение параметра recipes_limit или None,
+    если параметр не передан или некорректен."""
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+def get_recipes_prefetch(limit=None, only_ids=False):
+    """Подгружает рецепты авторов одним запросом, ограничивая
+    выборку последними limit рецептами каждого автора."""
+    recipes = Recipe.objects.all()
+    if only_ids:
+        recipes = recipes.only('id', 'author')
+    if limit is not None:
+        recipes = recipes.filter(id__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('id')[:limit]
+        ))
+    return Prefetch('recipes', queryset=recipes)
+
+
+class UserViewSet(SparseFieldsetViewMixin,
+                  mixins.RetrieveModelMixin,
                   mixins.ListModelMixin,
                   mixins.CreateModelMixin,
                   viewsets.GenericViewSet):
+    """Пользователи и подписки. Список, профиль и подписки
+    поддерживают ?fields= и ?expand=."""
     queryset = User.objects.all()
     lookup_field = 'id'
+    sparse_actions = ('list', 'retrieve', 'me', 'subscriptions')
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -62,10 +96,11 @@ class UserViewSet(mixins.RetrieveModelMixin,
         serializer.is_valid(raise_exception=True)
         self.request.user.set_password(
             serializer.data.get('new_password'))
-        self.request.user.save()
+        self.request.user.save(update_fields=('password',))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['post', 'delete'], detail=True)
+    @transaction.atomic
     def subscribe(self, request, id=None):
         user = request.user
         author = get_object_or_404(User, pk=id)
@@ -84,7 +119,11 @@ class UserViewSet(mixins.RetrieveModelMixin,
                 author=author,
                 subscriber=user
             )
-            serializer = UserForSubscriptionSerializer(author)
+            prefetch_related_objects(
+                [author], get_recipes_prefetch(get_recipes_limit(request)))
+            author.is_subscribed = True
+            serializer = UserForSubscriptionSerializer(
+                author, context=self.get_serializer_context())
 
             return Response(
                 serializer.data, status=status.HTTP_201_CREATED)
@@ -100,17 +139,22 @@ class UserViewSet(mixins.RetrieveModelMixin,
 
     @action(methods=['get'], detail=False)
     def subscriptions(self, request):
-        user = request.user
-        subscriptions = user.subscriber.all()
-
-        page = self.paginate_queryset(subscriptions)
-
-        authors = []
-
-        for p in page:
-            author = p.author
-            authors.append(author)
-        serializer = UserForSubscriptionSerializer(authors, many=True)
+        fieldset = self.get_fieldset(UserForSubscriptionSerializer)
+        authors = User.objects.filter(
+            author__subscriber=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
+        if fieldset is None or 'recipes' in fieldset:
+            authors = authors.prefetch_related(get_recipes_prefetch(
+                get_recipes_limit(request),
+                only_ids=fieldset is not None and not fieldset.expands(
+                    'recipes')))
+
+        page = self.paginate_queryset(authors)
+        serializer = UserForSubscriptionSerializer(
+            page, many=True, fieldset=fieldset,
+            context=self.get_serializer_context())
 
         return self.get_paginated_response(serializer.data)
 